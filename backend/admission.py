@@ -0,0 +1,160 @@
+# admission.py
+import asyncio
+import json
+import math
+import os
+import sqlite3
+from datetime import datetime
+
+# --- CONFIGURATION ---
+MAX_SESSIONS = int(os.getenv("MAX_SESSIONS", "0"))                 # Hard cap on top of the measured capacity (0 = none)
+MAX_SESSIONS_PER_USER = int(os.getenv("MAX_SESSIONS_PER_USER", "2"))  # Live + queued, per api.py user (or IP if anonymous)
+MAX_QUEUE = int(os.getenv("MAX_QUEUE", "20"))
+INFERENCE_PARALLELISM = int(os.getenv("INFERENCE_PARALLELISM", str(os.cpu_count() or 1)))
+HEADROOM = 0.7               # Plan for this fraction of the real-time budget, leaving room for spikes
+COST_SMOOTHING = 0.05        # EWMA weight of each new per-hop inference measurement
+QUEUE_UPDATE_INTERVAL = 1.0  # Seconds between admission re-checks for queued clients
+
+# --- CLOSE CODES (the front end maps these to messages) ---
+CLOSE_BUSY = 1013            # "Try Again Later": no capacity and the queue is full
+CLOSE_UNAUTHORIZED = 4401    # ?auth= token is invalid or expired
+CLOSE_USER_LIMIT = 4429      # This user already has MAX_SESSIONS_PER_USER sessions
+
+
+class Rejected(Exception):
+    def __init__(self, code, reason):
+        super().__init__(reason)
+        self.code = code
+        self.reason = reason
+
+
+class AuthUnavailable(Exception):
+    """api.py's auth tables are not in this server's database (not shared, or not created yet)."""
+
+
+class AdmissionController:
+    """
+    Admits live sessions only while the measured inference cost says every
+    admitted session can still get one inference per hop in real time.
+    Everyone else waits in a FIFO queue (with position updates) or is
+    turned away with a close code.
+    """
+
+    def __init__(self, hop_seconds):
+        self.hop_seconds = hop_seconds
+        self.hop_cost = None  # Smoothed seconds per inference, including executor wait
+        self.active = 0
+        self._per_user = {}
+        self._waiting = []    # Futures of queued clients, in arrival order
+
+    def record_cost(self, seconds):
+        if self.hop_cost is None:
+            self.hop_cost = seconds
+        else:
+            self.hop_cost += COST_SMOOTHING * (seconds - self.hop_cost)
+
+    def capacity(self):
+        if self.hop_cost:
+            limit = max(1, math.floor(self.hop_seconds * INFERENCE_PARALLELISM * HEADROOM / self.hop_cost))
+        else:
+            limit = INFERENCE_PARALLELISM  # Nothing measured yet
+        return min(limit, MAX_SESSIONS) if MAX_SESSIONS else limit
+
+    def status(self):
+        return {
+            "active": self.active,
+            "queued": len(self._waiting),
+            "capacity": self.capacity(),
+            "hop_cost": self.hop_cost,
+        }
+
+    async def admit(self, websocket, user_key):
+        """
+        Returns once the connection may start streaming. Raises Rejected if it
+        must be turned away, or ConnectionClosed if the client leaves while queued.
+        """
+        if self._per_user.get(user_key, 0) >= MAX_SESSIONS_PER_USER:
+            raise Rejected(CLOSE_USER_LIMIT, "Too many sessions for this user")
+
+        if not self._waiting and self.active < self.capacity():
+            self._acquire(user_key)
+            return
+
+        if len(self._waiting) >= MAX_QUEUE:
+            raise Rejected(CLOSE_BUSY, "Server busy, try again later")
+
+        granted = asyncio.get_running_loop().create_future()
+        self._waiting.append(granted)
+        self._per_user[user_key] = self._per_user.get(user_key, 0) + 1
+
+        # Audio keeps arriving while queued; drop it instead of buffering it
+        drain = asyncio.ensure_future(self._discard_messages(websocket))
+        try:
+            last_position = None
+            while not granted.done():
+                self._promote()
+                if granted.done():
+                    break
+                position = self._waiting.index(granted) + 1
+                if position != last_position:
+                    await websocket.send(json.dumps({"type": "queue", "position": position, "queued": len(self._waiting)}))
+                    last_position = position
+                await asyncio.wait([granted, drain], timeout=QUEUE_UPDATE_INTERVAL, return_when=asyncio.FIRST_COMPLETED)
+                if drain.done() and not granted.done():
+                    drain.result()  # Re-raises ConnectionClosed
+                    raise Rejected(CLOSE_BUSY, "Client left the queue")
+        except BaseException:
+            if granted in self._waiting:
+                self._waiting.remove(granted)
+                self._drop_user(user_key)
+            elif granted.done():
+                self._release(user_key)  # Admitted just as the client left
+            raise
+        finally:
+            drain.cancel()
+
+    def release(self, user_key):
+        self._release(user_key)
+
+    def _acquire(self, user_key):
+        self.active += 1
+        self._per_user[user_key] = self._per_user.get(user_key, 0) + 1
+
+    def _release(self, user_key):
+        self.active -= 1
+        self._drop_user(user_key)
+        self._promote()
+
+    def _drop_user(self, user_key):
+        self._per_user[user_key] -= 1
+        if self._per_user[user_key] <= 0:
+            del self._per_user[user_key]
+
+    def _promote(self):
+        # Queued users already hold their per-user slot, only `active` changes
+        while self._waiting and self.active < self.capacity():
+            granted = self._waiting.pop(0)
+            self.active += 1
+            granted.set_result(True)
+
+    @staticmethod
+    async def _discard_messages(websocket):
+        async for _ in websocket:
+            pass
+
+
+def lookup_user(db_path, token):
+    """
+    Resolves an api.py auth token to its user_id, or None if invalid/expired.
+    Raises AuthUnavailable if the database has no auth tables to check against.
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        row = conn.execute("SELECT user_id, expires_at FROM auth_tokens WHERE token = ?", (token,)).fetchone()
+    except sqlite3.OperationalError as e:
+        raise AuthUnavailable(str(e))
+    finally:
+        conn.close()
+    if not row or datetime.now() > datetime.fromisoformat(row[1]):
+        return None
+    return row[0]
@@ -2,20 +2,32 @@
 import uvicorn
 import os
 from fastapi import FastAPI, Response, HTTPException, Depends, Request
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, Field, ValidationError
+from typing import Annotated, Literal, Optional
+from typing_extensions import TypedDict, NotRequired
 from contextlib import asynccontextmanager
 import aiosqlite
 import hashlib
 import secrets
 import uuid
 import json
+import orjson
 from datetime import datetime, timedelta
 from lilypond import convert_to_lilypond
+from notation import quantize_notes
+from recording_log import LIVE_SCHEMA, LIVE_ADDED_COLUMNS
+
+try:
+    from brotli_asgi import BrotliMiddleware  # In requirements.txt; gzip only without it
+except ImportError:
+    BrotliMiddleware = None
 
 # --- CONFIGURATION ---
-DATABASE_FILE = "music_transcriber.db"
+DATABASE_FILE = os.getenv("DATABASE_FILE", "music_transcriber.db")
 SECRET_KEY = os.getenv("SECRET_KEY", "DEV_SECRET_KEY_123") # ### CHANGED: Use Env var for security
 
 # --- SECURITY UTILS ---
@@ -42,20 +54,48 @@ class UserLogin(BaseModel):
     email: EmailStr
     password: str
 
-class NoteData(BaseModel):
+# Notes are validated as plain dicts rather than models: no per-note object
+# is built, and the validated dicts can be stored as-is.
+class NoteData(TypedDict):
     id: str
     keys: list[str]
     duration: str
     rawDuration: float
     startTimeOffset: float
     isRest: bool
-    color: str = None
+    color: NotRequired[Optional[str]]
+
+Bpm = Annotated[int, Field(gt=0)]  # Quantizing divides by it
+
+class RecordingRef(BaseModel):
+    token: str   # Live recording token from the audio server's "session" event
+    start: int   # notes[start:] are the client's copy of that take
 
 class SessionCreate(BaseModel):
     title: str
-    bpm: int
+    bpm: Bpm
     notes: list[NoteData]
     createdAt: str
+    recording: Optional[RecordingRef] = None
+
+class NoteOp(BaseModel):
+    op: Literal["append", "replace_range"]
+    start: Optional[int] = None   # replace_range only: notes[start:end] are replaced
+    end: Optional[int] = None
+    notes: list[NoteData] = []
+
+class SessionPatch(BaseModel):
+    version: int                  # Version the client last saw; 409 if it moved on
+    ops: list[NoteOp]
+    title: Optional[str] = None
+    bpm: Optional[Bpm] = None
+    recording: Optional[RecordingRef] = None  # Applied after the ops
+
+class RecordingHandoff(BaseModel):
+    token: str
+    title: str
+    bpm: Bpm
+    createdAt: str
 
 # --- DB LIFESPAN ---
 @asynccontextmanager
@@ -87,12 +127,164 @@ async def lifespan(app: FastAPI):
                 notes_json TEXT,
                 created_at TEXT,
                 updated_at TEXT,
+                version INTEGER DEFAULT 0,
+                note_count INTEGER DEFAULT 0,
                 FOREIGN KEY(user_id) REFERENCES users(user_id)
             )
         """)
+        # One row per note, so appends and edits only touch the changed notes
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS session_notes (
+                session_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                note_json TEXT NOT NULL,
+                FOREIGN KEY(session_id) REFERENCES sessions(session_id)
+            )
+        """)
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_session_notes ON session_notes (session_id, seq)")
+        await migrate_sessions(db)
+        # Live recordings written by the audio server (see recording_log.py)
+        for statement in LIVE_SCHEMA:
+            await db.execute(statement)
+        for table, column, kind in LIVE_ADDED_COLUMNS:
+            cursor = await db.execute(f"PRAGMA table_info({table})")
+            if column not in {row[1] for row in await cursor.fetchall()}:
+                await db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {kind}")
         await db.commit()
     yield
 
+async def migrate_sessions(db):
+    """Adds the versioning columns to old databases and moves notes_json blobs into session_notes."""
+    cursor = await db.execute("PRAGMA table_info(sessions)")
+    columns = {row[1] for row in await cursor.fetchall()}
+    if "version" not in columns:
+        await db.execute("ALTER TABLE sessions ADD COLUMN version INTEGER DEFAULT 0")
+    if "note_count" not in columns:
+        await db.execute("ALTER TABLE sessions ADD COLUMN note_count INTEGER DEFAULT 0")
+
+    cursor = await db.execute("SELECT session_id, notes_json FROM sessions WHERE notes_json IS NOT NULL")
+    for session_id, notes_json in await cursor.fetchall():
+        try:
+            notes = json.loads(notes_json)
+        except ValueError:
+            notes = []
+        await insert_notes(db, session_id, 0, notes)
+        await db.execute(
+            "UPDATE sessions SET notes_json = NULL, note_count = ? WHERE session_id = ?",
+            (len(notes), session_id)
+        )
+
+# --- NOTE STORAGE ---
+async def insert_notes(db, session_id, first_seq, notes_dict):
+    await db.executemany(
+        "INSERT INTO session_notes (session_id, seq, note_json) VALUES (?, ?, ?)",
+        # orjson: serializing every note is most of the insert cost, and json.dumps is ~10x slower
+        [(session_id, first_seq + i, orjson.dumps(note).decode()) for i, note in enumerate(notes_dict)]
+    )
+
+async def read_notes(db, session_id, start=0, end=None):
+    """Returns notes[start:end] of a session, in score order."""
+    return json.loads(await read_notes_json(db, session_id, start, end))
+
+async def read_notes_json(db, session_id, start=0, end=None):
+    """
+    Same as read_notes, but as a JSON array string built from the stored
+    per-note JSON. Nothing is parsed, so it can go straight into a response.
+    """
+    if end is None:
+        cursor = await db.execute(
+            "SELECT note_json FROM session_notes WHERE session_id = ? AND seq >= ? ORDER BY seq",
+            (session_id, start)
+        )
+    else:
+        cursor = await db.execute(
+            "SELECT note_json FROM session_notes WHERE session_id = ? AND seq >= ? AND seq < ? ORDER BY seq",
+            (session_id, start, end)
+        )
+    return "[" + ",".join([row[0] for row in await cursor.fetchall()]) + "]"
+
+async def replace_note_range(db, session_id, start, end, notes_dict):
+    """Replaces notes[start:end], shifting only the notes after the range."""
+    await db.execute(
+        "DELETE FROM session_notes WHERE session_id = ? AND seq >= ? AND seq < ?",
+        (session_id, start, end)
+    )
+    shift = len(notes_dict) - (end - start)
+    if shift:
+        await db.execute(
+            "UPDATE session_notes SET seq = seq + ? WHERE session_id = ? AND seq >= ?",
+            (shift, session_id, end)
+        )
+    await insert_notes(db, session_id, start, notes_dict)
+    return shift
+
+async def store_recording(db, session_id, user_id, recording, bpm, note_count):
+    """
+    Replaces notes[recording.start:] (the client's copy of a live take) with
+    the server's quantization of the logged take, then drops the log.
+    Returns (note_count, stored notes), or (note_count, None) if the
+    recording is unknown, expired, already saved or not this user's; the
+    client's copy is kept in that case.
+    """
+    cursor = await db.execute(
+        "SELECT 1 FROM live_recordings WHERE token = ? AND user_id = ? AND session_id IS NULL",
+        (recording.token, user_id)
+    )
+    if not await cursor.fetchone():
+        return note_count, None
+    if not 0 <= recording.start <= note_count:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail=f"Invalid recording start {recording.start} for {note_count} notes.")
+    if not bpm or bpm <= 0:  # Sessions saved before bpm was validated
+        await db.rollback()
+        raise HTTPException(status_code=400, detail=f"Invalid bpm {bpm} for quantizing the recording.")
+
+    cursor = await db.execute(
+        "SELECT midi, start_time, duration FROM live_notes WHERE token = ? ORDER BY seq", (recording.token,)
+    )
+    notes_dict = quantize_notes(await cursor.fetchall(), bpm)
+    note_count += await replace_note_range(db, session_id, recording.start, note_count, notes_dict)
+    await db.execute("UPDATE live_recordings SET session_id = ? WHERE token = ?", (session_id, recording.token))
+    await db.execute("DELETE FROM live_notes WHERE token = ?", (recording.token,))
+    return note_count, notes_dict
+
+def recording_result(recording, notes_dict):
+    """The stored take, so the client can swap it in for its own copy."""
+    if notes_dict is None:
+        return None
+    return {"start": recording.start, "notes": notes_dict}
+
+async def parse_body(request: Request, model):
+    """
+    Validates the raw request body in a single pass (JSON parsing and
+    validation both happen inside pydantic-core).
+    """
+    try:
+        return model.model_validate_json(await request.body())
+    except ValidationError as e:
+        raise RequestValidationError([{**err, "loc": ("body", *err["loc"])} for err in e.errors()])
+
+def json_body(model):
+    """
+    openapi_extra for routes that read their body through parse_body, so the
+    docs still show the schema FastAPI would have generated for `model`.
+    """
+    schema = model.model_json_schema()
+    defs = schema.pop("$defs", {})
+
+    def inline(node):
+        # Nested models are referenced as #/$defs/<name>, which only resolves inside this schema
+        if isinstance(node, dict):
+            ref = node.get("$ref", "")
+            if ref.startswith("#/$defs/"):
+                return inline(defs[ref[len("#/$defs/"):]])
+            return {key: inline(value) for key, value in node.items()}
+        if isinstance(node, list):
+            return [inline(value) for value in node]
+        return node
+
+    return {"requestBody": {"required": True, "content": {"application/json": {"schema": inline(schema)}}}}
+
 app = FastAPI(lifespan=lifespan)
 
 # AWS change
@@ -103,6 +295,12 @@ origins = [
     frontend_url,            # Frontend URL
 ]
 
+# Compress large note payloads (br when available, gzip otherwise)
+if BrotliMiddleware:
+    app.add_middleware(BrotliMiddleware, minimum_size=1024)
+else:
+    app.add_middleware(GZipMiddleware, minimum_size=1024)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"], # WARNING: Set to ["*"] to allow ALL during initial AWS setup. Change back to 'origins' later for security.
@@ -193,42 +391,146 @@ async def get_me(user = Depends(get_current_user)):
     return user
 
 # --- SESSION ROUTES ---
-@app.post("/api/sessions")
-async def save_session(data: SessionCreate, user = Depends(get_current_user)):
+@app.post("/api/sessions", openapi_extra=json_body(SessionCreate))
+async def save_session(request: Request, user = Depends(get_current_user)):
+    data = await parse_body(request, SessionCreate)
     async with aiosqlite.connect(DATABASE_FILE) as db:
         session_id = str(uuid.uuid4())
-        notes_dict = [note.dict() for note in data.notes]
+        notes_dict = data.notes
         
         await db.execute("""
-            INSERT INTO sessions (session_id, user_id, title, bpm, notes_json, created_at, updated_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        """, (session_id, user['user_id'], data.title, data.bpm, json.dumps(notes_dict), data.createdAt, datetime.now().isoformat()))
+            INSERT INTO sessions (session_id, user_id, title, bpm, created_at, updated_at, version, note_count)
+            VALUES (?, ?, ?, ?, ?, ?, 0, ?)
+        """, (session_id, user['user_id'], data.title, data.bpm, data.createdAt, datetime.now().isoformat(), len(notes_dict)))
+        await insert_notes(db, session_id, 0, notes_dict)
+        note_count, recorded = len(notes_dict), None
+        if data.recording:
+            note_count, recorded = await store_recording(db, session_id, user['user_id'], data.recording, data.bpm, note_count)
+            await db.execute("UPDATE sessions SET note_count = ? WHERE session_id = ?", (note_count, session_id))
         await db.commit()
-        return {"session_id": session_id, "status": "saved"}
+        return {
+            "session_id": session_id, "status": "saved", "version": 0, "note_count": note_count,
+            "recording": recording_result(data.recording, recorded),
+        }
+
+@app.patch("/api/sessions/{session_id}", openapi_extra=json_body(SessionPatch))
+async def patch_session(session_id: str, request: Request, user = Depends(get_current_user)):
+    """
+    Applies append / replace_range operations to a saved session. Uses the
+    version column for optimistic concurrency: the update only applies if
+    the client's version is still current.
+    """
+    data = await parse_body(request, SessionPatch)
+    async with aiosqlite.connect(DATABASE_FILE) as db:
+        cursor = await db.execute("""
+            UPDATE sessions
+            SET version = version + 1, updated_at = ?, title = COALESCE(?, title), bpm = COALESCE(?, bpm)
+            WHERE session_id = ? AND user_id = ? AND version = ?
+        """, (datetime.now().isoformat(), data.title, data.bpm, session_id, user['user_id'], data.version))
+
+        if cursor.rowcount == 0:
+            cursor = await db.execute(
+                "SELECT version FROM sessions WHERE session_id = ? AND user_id = ?", (session_id, user['user_id'])
+            )
+            row = await cursor.fetchone()
+            await db.rollback()
+            if not row:
+                raise HTTPException(status_code=404, detail="Session not found.")
+            raise HTTPException(status_code=409, detail={"message": "Session was modified.", "version": row[0]})
+
+        cursor = await db.execute("SELECT note_count, bpm FROM sessions WHERE session_id = ?", (session_id,))
+        note_count, bpm = await cursor.fetchone()
+
+        for op in data.ops:
+            notes_dict = op.notes
+            if op.op == "append":
+                await insert_notes(db, session_id, note_count, notes_dict)
+                note_count += len(notes_dict)
+            else:
+                start = op.start if op.start is not None else 0
+                end = op.end if op.end is not None else note_count
+                if not 0 <= start <= end <= note_count:
+                    await db.rollback()
+                    raise HTTPException(status_code=400, detail=f"Invalid range [{start}, {end}) for {note_count} notes.")
+                note_count += await replace_note_range(db, session_id, start, end, notes_dict)
+
+        recorded = None
+        if data.recording:
+            note_count, recorded = await store_recording(db, session_id, user['user_id'], data.recording, bpm, note_count)
+
+        await db.execute("UPDATE sessions SET note_count = ? WHERE session_id = ?", (note_count, session_id))
+        await db.commit()
+        return {
+            "session_id": session_id, "version": data.version + 1, "note_count": note_count,
+            "recording": recording_result(data.recording, recorded),
+        }
+
+@app.get("/api/sessions/{session_id}")
+async def get_session(session_id: str, start: int = 0, end: Optional[int] = None, user = Depends(get_current_user)):
+    """Returns session metadata plus notes[start:end] (all notes by default)."""
+    async with aiosqlite.connect(DATABASE_FILE) as db:
+        db.row_factory = aiosqlite.Row
+        cursor = await db.execute("""
+            SELECT session_id, title, bpm, created_at, updated_at, version, note_count
+            FROM sessions
+            WHERE session_id = ? AND user_id = ?
+        """, (session_id, user['user_id']))
+        row = await cursor.fetchone()
+        if not row:
+            raise HTTPException(status_code=404, detail="Session not found.")
+        if start < 0 or (end is not None and end < start):
+            raise HTTPException(status_code=400, detail="Invalid note range.")
+
+        session = dict(row)
+        session["start"] = start
+        notes_json = await read_notes_json(db, session_id, start, end)
+        # Splice the stored notes in as-is instead of parsing and re-encoding them
+        body = f'{json.dumps(session)[:-1]}, "notes": {notes_json}}}'
+        return Response(content=body, media_type="application/json")
+
+@app.post("/api/sessions/from-recording")
+async def save_live_recording(data: RecordingHandoff, user = Depends(get_current_user)):
+    """
+    Turns a live recording logged by the audio server into a new saved
+    session on its own, then drops the per-note log.
+    """
+    async with aiosqlite.connect(DATABASE_FILE) as db:
+        session_id = str(uuid.uuid4())
+        await db.execute("""
+            INSERT INTO sessions (session_id, user_id, title, bpm, created_at, updated_at, version, note_count)
+            VALUES (?, ?, ?, ?, ?, ?, 0, 0)
+        """, (session_id, user['user_id'], data.title, data.bpm, data.createdAt, datetime.now().isoformat()))
+        note_count, recorded = await store_recording(
+            db, session_id, user['user_id'], RecordingRef(token=data.token, start=0), data.bpm, 0
+        )
+        if recorded is None:
+            await db.rollback()
+            raise HTTPException(status_code=404, detail="Recording not found or already saved.")
+        await db.execute("UPDATE sessions SET note_count = ? WHERE session_id = ?", (note_count, session_id))
+        await db.commit()
+        return {"session_id": session_id, "status": "saved", "version": 0, "note_count": note_count}
 
 @app.get("/api/notes")
 async def get_latest_notes(user = Depends(get_current_user)):
     async with aiosqlite.connect(DATABASE_FILE) as db:
         db.row_factory = aiosqlite.Row
         cursor = await db.execute("""
-            SELECT notes_json FROM sessions 
+            SELECT session_id FROM sessions 
             WHERE user_id = ? 
             ORDER BY created_at DESC LIMIT 1
         """, (user['user_id'],))
         row = await cursor.fetchone()
         
         if not row: return []
-        try:
-            return json.loads(row['notes_json'])
-        except:
-            return []
+        notes_json = await read_notes_json(db, row['session_id'])
+        return Response(content=notes_json, media_type="application/json")
 
 @app.get("/api/sessions")
 async def list_sessions(user = Depends(get_current_user)):
     async with aiosqlite.connect(DATABASE_FILE) as db:
         db.row_factory = aiosqlite.Row
         cursor = await db.execute("""
-            SELECT session_id, title, bpm, created_at, updated_at 
+            SELECT session_id, title, bpm, created_at, updated_at, version, note_count 
             FROM sessions 
             WHERE user_id = ? 
             ORDER BY updated_at DESC
@@ -242,7 +544,7 @@ async def export_pdf(user = Depends(get_current_user)):
     async with aiosqlite.connect(DATABASE_FILE) as db:
         db.row_factory = aiosqlite.Row
         cursor = await db.execute("""
-            SELECT notes_json FROM sessions 
+            SELECT session_id FROM sessions 
             WHERE user_id = ? 
             ORDER BY created_at DESC LIMIT 1
         """, (user['user_id'],))
@@ -251,8 +553,8 @@ async def export_pdf(user = Depends(get_current_user)):
         if not row:
             raise HTTPException(status_code=404, detail="No session found to export.")
         try:
-            notes_data = json.loads(row['notes_json'])
-        except:
+            notes_data = await read_notes(db, row['session_id'])
+        except ValueError:
             raise HTTPException(status_code=500, detail="Database error: Corrupt note data.")
 
     pdf_bytes, error_msg = await convert_to_lilypond(notes_data)
@@ -1,14 +1,23 @@
 import asyncio
 import websockets
 import json
+import os
 import time
+from urllib.parse import urlparse, parse_qs
 import numpy as np
-from basic_pitch.inference import Model, ICASSP_2022_MODEL_PATH
+from startup import StartupTracker, warm_up, health_check
+from recording_log import (
+    RecordingLog, SessionWriter, RecordingBusy, RecordingLogError, CLOSE_TAKEN_OVER, CLOSE_LOG_FAILED
+)
+from note_store import ActiveNotes, NOTE_NAME_TABLE
+from admission import AdmissionController, AuthUnavailable, Rejected, lookup_user, CLOSE_UNAUTHORIZED
+from notation import IncrementalQuantizer
 
 # --- CONFIGURATION ---
 SAMPLE_RATE = 22050
 HOP_SIZE = 768
 WINDOW_LENGTH = 43844
+DATABASE_FILE = os.getenv("DATABASE_FILE", "music_transcriber.db")  # Same DB as api.py
 
 # --- HYSTERESIS THRESHOLDS ---
 ONSET_THRESHOLD = 0.6          # Sensitivity for starting a NEW note from silence
@@ -20,29 +29,184 @@ MIN_VOLUME = 0.001
 # --- COOLDOWN ---
 RETRIGGER_COOLDOWN = 0.12
 
-NOTE_NAMES = ["C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B"]
+FOCUS_FRAMES = 8  # Model frames at the end of the window that decide the current hop
 
-print("Loading Basic Pitch Model...")
-model = Model(ICASSP_2022_MODEL_PATH)
-print("Model Loaded. Ready.")
+# --- TUNED THRESHOLDS ---
+# tune_thresholds.py exports the best sweep result here; missing file = defaults above
+THRESHOLDS_FILE = os.getenv("THRESHOLDS_FILE", "thresholds.json")
+TUNABLE_PARAMS = (
+    "ONSET_THRESHOLD", "RETRIGGER_ONSET_THRESHOLD", "NOTE_START_THRESHOLD",
+    "NOTE_KEEP_THRESHOLD", "RETRIGGER_COOLDOWN",
+)
+
+def load_thresholds(path=THRESHOLDS_FILE):
+    if not os.path.exists(path):
+        return
+    with open(path) as f:
+        overrides = json.load(f)
+    for name in TUNABLE_PARAMS:
+        if name in overrides:
+            globals()[name] = float(overrides[name])
+    print(f"Loaded thresholds from {path}: " + ", ".join(f"{n}={globals()[n]}" for n in TUNABLE_PARAMS))
+
+# --- MODEL (loaded during startup, not at import) ---
+predict = None
+startup = StartupTracker()
+recording_log = None
+live_takes = {}  # Recording token -> (websocket, writer, user_id) of the connection appending to it
+admission = AdmissionController(hop_seconds=HOP_SIZE / SAMPLE_RATE)
+
+def load_basic_pitch_predictor():
+    # Heavy imports live here so importing this module stays cheap
+    from basic_pitch.inference import Model, ICASSP_2022_MODEL_PATH
+    model = Model(ICASSP_2022_MODEL_PATH)
+    return model.predict
+
+def run_startup(load_predictor):
+    """
+    Loads the model and warms it up. Runs in a worker thread so /healthz and
+    /readyz keep answering while TensorFlow initializes.
+    """
+    global predict
+    with startup.stage("load_model"):
+        loaded = load_predictor()
+    with startup.stage("warm_up"):
+        startup.warmup_cost = warm_up(loaded, WINDOW_LENGTH)
+    predict = loaded
+    if startup.warmup_cost:
+        admission.record_cost(startup.warmup_cost)  # Seed capacity before real traffic
+    startup.mark_ready()
 
 def midi_to_note_name(midi_number):
-    octave = (midi_number // 12) - 1
-    note_index = midi_number % 12
-    return f"{NOTE_NAMES[note_index]}{octave}"
+    return NOTE_NAME_TABLE[midi_number]
+
+def request_path(websocket):
+    # Legacy protocol objects expose .path, the current asyncio server .request.path
+    request = getattr(websocket, "request", None)
+    return request.path if request is not None else websocket.path
 
 async def audio_handler(websocket):
     print(f"Client connected: {websocket.remote_address}")
+    query = parse_qs(urlparse(request_path(websocket)).query)
+
+    # Optional ?auth=<api.py token>, so per-user limits follow the account
+    user_id = None
+    auth_token = query.get("auth", [None])[0]
+    if auth_token:
+        loop = asyncio.get_running_loop()
+        try:
+            user_id = await loop.run_in_executor(None, lookup_user, DATABASE_FILE, auth_token)
+        except AuthUnavailable as e:
+            # Cannot tell a bad token from a missing database, so don't lock signed-in users out
+            print(f"Auth unavailable ({e}), serving anonymously; is DATABASE_FILE shared with api.py?")
+        else:
+            if not user_id:
+                await websocket.close(CLOSE_UNAUTHORIZED, "Invalid or expired token")
+                return
+    user_key = user_id or f"ip:{websocket.remote_address[0]}"
+
+    try:
+        await admission.admit(websocket, user_key)
+    except Rejected as r:
+        print(f"Rejected {websocket.remote_address}: {r.reason} ({admission.status()})")
+        await websocket.close(r.code, r.reason)
+        return
+    except websockets.exceptions.ConnectionClosed:
+        return
+
+    try:
+        await websocket.send(json.dumps({"type": "admitted"}))
+        await transcribe(websocket, query, user_id)
+    except websockets.exceptions.ConnectionClosed:
+        pass
+    finally:
+        admission.release(user_key)
+
+async def take_over(token, user_id):
+    """
+    A reconnect can arrive before the old connection has noticed it is gone.
+    Close the old one and wait for its final flush, so the two never write
+    the same notes. Only the recording's owner can take it over.
+    """
+    held = live_takes.get(token)
+    if held and held[2] == user_id:
+        old_websocket, old_writer, _ = held
+        await old_websocket.close(CLOSE_TAKEN_OVER, "Recording resumed on a new connection")
+        await old_writer.wait_closed()
+
+async def transcribe(websocket, query, user_id):
+    # Only signed-in takes are logged: only their owner can resume or save them
+    writer = None
+    if user_id:
+        # Reconnects pass ?session=<token> to keep appending to the same take
+        resume_token = query.get("session", [None])[0]
+        if resume_token:
+            await take_over(resume_token, user_id)
+        try:
+            token, note_count, elapsed = await recording_log.open_session(user_id, resume_token)
+        except RecordingBusy:
+            await websocket.close(CLOSE_TAKEN_OVER, "Recording is open on another connection")
+            return
+        writer = SessionWriter(recording_log, token, note_count, elapsed)
+        live_takes[token] = (websocket, writer, user_id)
+    time_offset = writer.time_offset if writer else 0.0  # Resumed takes continue after the logged audio and measures
+    notes_recorded = 0
     
     audio_buffer = np.zeros((1, WINDOW_LENGTH, 1), dtype=np.float32)
     input_accumulator = []
-    active_notes = {} 
+    active_notes = ActiveNotes()
     
     session_start_time = None
-    recorded_song = []
 
+    # ?bpm=<n> turns on server-side quantization: settled measures are sent as ready-to-render NoteData
+    # (the record button always sends it; the client no longer quantizes notes itself)
+    bpm = query.get("bpm", [""])[0]
+    quantizer = IncrementalQuantizer(int(bpm), start_time=time_offset) if bpm.isdigit() and int(bpm) > 0 else None
+
+    def finish_note(midi_num, start_time, duration):
+        nonlocal notes_recorded
+        notes_recorded += 1
+        if writer:
+            writer.add(midi_num, start_time, duration)
+        if quantizer:
+            quantizer.add(midi_num, start_time, duration)
+
+    async def send_measures(measures):
+        for measure, notes in measures:
+            await websocket.send(json.dumps({
+                "type": "measure", "measure": measure, "notes": notes,
+                "until": round(quantizer.measure_end(measure), 3),  # Notes starting before this are now in measures
+            }))
+            if writer:
+                writer.settle(quantizer.measure_start(measure + 1))
+
+    async def send_settled_measures():
+        if not quantizer or session_start_time is None:
+            return
+        # Nothing can start before now, or before the earliest note still sounding
+        now = time.time()
+        earliest = active_notes.earliest()
+        horizon = min(now, earliest) if earliest is not None else now
+        await send_measures(quantizer.settle(horizon - session_start_time + time_offset))
+
+    stopped = False
     try:
+        if writer:
+            session = {"type": "session", "token": token, "resumed": note_count > 0, "note_count": note_count}
+            if quantizer:
+                session["next_measure"] = quantizer.next_measure  # Earlier measures were already sent
+            await websocket.send(json.dumps(session))
+
         async for message in websocket:
+            if isinstance(message, str):
+                # Audio is always binary; text frames are control messages
+                try:
+                    stopped = json.loads(message).get("type") == "stop"
+                except (ValueError, AttributeError):
+                    stopped = False
+                if stopped:
+                    break
+                continue
             try:
                 chunk = np.frombuffer(message, dtype=np.float32)
             except Exception:
@@ -60,32 +224,36 @@ async def audio_handler(websocket):
 
             volume = float(np.sqrt(np.mean(new_data**2)))
             await websocket.send(json.dumps({"type": "volume", "value": volume}))
+            if writer:
+                await writer.backpressure()
             
             # --- SILENCE HANDLING ---
             if volume < MIN_VOLUME:
                 if active_notes:
                     now = time.time()
                     for midi_num, start in active_notes.items():
-                        rel_start = start - session_start_time
+                        rel_start = start - session_start_time + time_offset
                         dur = now - start
                         note_data = {"note": midi_to_note_name(midi_num), "midi": midi_num, "start_time": round(rel_start, 3), "duration": round(dur, 3)}
-                        recorded_song.append(note_data)
+                        finish_note(midi_num, note_data["start_time"], note_data["duration"])
                         await websocket.send(json.dumps({"type": "note_off", **note_data}))
-                    active_notes = {}
+                    active_notes.clear()
                     await websocket.send(json.dumps({"type": "silence_reset"}))
+                await send_settled_measures()
                 continue
 
             # --- AI PROCESSING ---
             loop = asyncio.get_running_loop()
-            output = await loop.run_in_executor(None, lambda: model.predict(audio_buffer))
+            t0 = time.perf_counter()
+            output = await loop.run_in_executor(None, lambda: predict(audio_buffer))
+            admission.record_cost(time.perf_counter() - t0)
             
             note_probs = output['note']
             onset_probs = output['onset']
             if note_probs is None: continue
 
-            focus = 8
-            current_notes_max = np.max(note_probs[0, -focus:, :], axis=0)
-            current_onsets_max = np.max(onset_probs[0, -focus:, :], axis=0)
+            current_notes_max = np.max(note_probs[0, -FOCUS_FRAMES:, :], axis=0)
+            current_onsets_max = np.max(onset_probs[0, -FOCUS_FRAMES:, :], axis=0)
 
             # --- SUPPRESSION LOGIC (Iterate High -> Low) ---
             for i in range(87, 24, -1): 
@@ -137,7 +305,7 @@ async def audio_handler(websocket):
                         if is_retrigger_attack and (now - active_notes[midi_num]) > RETRIGGER_COOLDOWN:
                             old_start = active_notes[midi_num]
                             duration = now - old_start
-                            rel_start = old_start - session_start_time
+                            rel_start = old_start - session_start_time + time_offset
 
                             note_data = {
                                 "note": midi_to_note_name(midi_num), 
@@ -147,7 +315,7 @@ async def audio_handler(websocket):
                             }
                             
                             # 1. Archive the old note
-                            recorded_song.append(note_data)
+                            finish_note(midi_num, note_data["start_time"], note_data["duration"])
                             
                             # 2. Send Note OFF for the previous instance (Crucial Fix)
                             await websocket.send(json.dumps({"type": "note_off", **note_data}))
@@ -159,7 +327,7 @@ async def audio_handler(websocket):
                                 "note": midi_to_note_name(midi_num), 
                                 "midi": midi_num,
                                 "event": "re_trigger", 
-                                "start_time": round(now - session_start_time, 3)
+                                "start_time": round(now - session_start_time + time_offset, 3)
                             }))
                     else:
                         # --- NEW NOTE LOGIC (Fixed for G4 Issue) ---
@@ -172,7 +340,7 @@ async def audio_handler(websocket):
                                 "note": midi_to_note_name(midi_num), 
                                 "midi": midi_num,
                                 "event": "new_attack", 
-                                "start_time": round(now - session_start_time, 3)
+                                "start_time": round(now - session_start_time + time_offset, 3)
                             }))
 
             # --- CLEANUP ---
@@ -180,7 +348,7 @@ async def audio_handler(websocket):
                 if midi_num not in detected_this_frame:
                     start_time = active_notes[midi_num]
                     duration = now - start_time
-                    rel_start = start_time - session_start_time
+                    rel_start = start_time - session_start_time + time_offset
                     
                     note_info = {
                         "note": midi_to_note_name(midi_num),
@@ -188,19 +356,56 @@ async def audio_handler(websocket):
                         "start_time": round(rel_start, 3),
                         "duration": round(duration, 3)
                     }
-                    recorded_song.append(note_info)
+                    finish_note(midi_num, note_info["start_time"], note_info["duration"])
                     del active_notes[midi_num]
                     await websocket.send(json.dumps({"type": "note_off", **note_info}))
 
+            await send_settled_measures()
+
     except websockets.exceptions.ConnectionClosed:
-        print(f"Connection closed. Notes recorded: {len(recorded_song)}")
+        print(f"Connection closed. Notes recorded: {notes_recorded}")
+    except RecordingLogError as e:
+        print(f"Recording log error: {e}")
+        await websocket.close(CLOSE_LOG_FAILED, "Recording could not be saved")
     except Exception as e:
         print(f"Error: {e}")
+    finally:
+        # Notes still sounding when the take ends are finished now
+        now = time.time()
+        for midi_num, start in active_notes.items():
+            finish_note(midi_num, round(start - session_start_time + time_offset, 3), round(now - start, 3))
+        active_notes.clear()
+        if writer:
+            try:
+                await writer.close()
+            finally:
+                if live_takes.get(token, (None,))[0] is websocket:
+                    del live_takes[token]
+
+    if stopped:
+        # Send the last, partly filled measures, then confirm the whole take is logged
+        if quantizer:
+            await send_measures(quantizer.flush())
+        await websocket.send(json.dumps({"type": "take_end", "notes": notes_recorded}))
 
-async def main():
-    print("Server running on localhost:8000")
-    async with websockets.serve(audio_handler, "0.0.0.0", 8000):
-        await asyncio.Future()
+async def main(load_predictor=load_basic_pitch_predictor):
+    global recording_log
+    load_thresholds()
+    recording_log = RecordingLog(DATABASE_FILE)
+    expiry_task = asyncio.ensure_future(recording_log.expire_periodically())  # Referenced so it is not collected
+    print("Server running on 0.0.0.0:8000 (health: /healthz, /readyz)")
+    try:
+        async with websockets.serve(audio_handler, "0.0.0.0", 8000, process_request=health_check(startup)):
+            loop = asyncio.get_running_loop()
+            try:
+                await loop.run_in_executor(None, run_startup, load_predictor)
+            except Exception as e:
+                # Keep serving so /healthz reports the failure instead of the process vanishing
+                startup.error = startup.error or f"startup: {e}"
+                print(f"[startup] Not ready, serving /healthz as unhealthy: {startup.error}")
+            await asyncio.Future()
+    finally:
+        expiry_task.cancel()
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,139 @@
+# bench_notes.py
+# Compares the old blob-per-session note handling with the per-note rows and
+# fast paths in api.py, across session sizes, against a throwaway database.
+# Run from the backend folder: python bench_notes.py
+import asyncio
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from datetime import datetime
+from typing import Optional
+
+# api.py reads this at import time; never touch the real database
+BENCH_DIR = tempfile.mkdtemp(prefix="bench_notes_")
+os.environ["DATABASE_FILE"] = os.path.join(BENCH_DIR, "bench.db")
+
+import aiosqlite
+from fastapi.encoders import jsonable_encoder
+from fastapi.testclient import TestClient
+from pydantic import BaseModel
+
+import api
+from api import SessionCreate, insert_notes, read_notes_json
+
+SIZES = [100, 1_000, 10_000, 50_000]
+REPEATS = 5
+
+# The pre-fast-path NoteData model, for comparison
+class NoteModel(BaseModel):
+    id: str
+    keys: list[str]
+    duration: str
+    rawDuration: float
+    startTimeOffset: float
+    isRest: bool
+    color: Optional[str] = None
+
+class OldSessionCreate(BaseModel):
+    title: str
+    bpm: int
+    notes: list[NoteModel]
+    createdAt: str
+
+def make_payload(n):
+    notes = [{
+        "id": str(uuid.uuid4()),
+        "keys": ["c#/4", "e/4"] if i % 4 == 0 else ["g/4"],
+        "duration": "q",
+        "rawDuration": 0.512,
+        "startTimeOffset": i * 0.6,
+        "isRest": False,
+        "color": "black",
+    } for i in range(n)]
+    return json.dumps({"title": "Bench", "bpm": 100, "notes": notes, "createdAt": datetime.now().isoformat()}).encode()
+
+def timed(fn):
+    best = float("inf")
+    for _ in range(REPEATS):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best * 1000
+
+# --- STORAGE (parse/validate + SQLite, as the endpoints do it) ---
+async def ingest_old(db, body):
+    data = OldSessionCreate(**json.loads(body))
+    notes_json = json.dumps([note.model_dump() for note in data.notes])
+    await db.execute("INSERT INTO old_sessions (session_id, notes_json) VALUES (?, ?)", (str(uuid.uuid4()), notes_json))
+    await db.commit()
+
+async def ingest_new(db, body):
+    data = SessionCreate.model_validate_json(body)
+    await insert_notes(db, str(uuid.uuid4()), 0, data.notes)
+    await db.commit()
+
+async def serve_old(db, session_id):
+    cursor = await db.execute("SELECT notes_json FROM old_sessions WHERE session_id = ?", (session_id,))
+    notes_json = (await cursor.fetchone())[0]
+    return json.dumps(jsonable_encoder(json.loads(notes_json))).encode()
+
+async def serve_new(db, session_id):
+    return (await read_notes_json(db, session_id)).encode()
+
+async def bench_storage(body):
+    """Returns (ingest old, ingest new, serve old, serve new) in ms, plus the served bytes."""
+    async with aiosqlite.connect(os.environ["DATABASE_FILE"]) as db:
+        await db.execute("CREATE TABLE IF NOT EXISTS old_sessions (session_id TEXT PRIMARY KEY, notes_json TEXT)")
+
+        async def timed_async(make_call):
+            best = float("inf")
+            for _ in range(REPEATS):
+                t0 = time.perf_counter()
+                await make_call()
+                best = min(best, time.perf_counter() - t0)
+            return best * 1000
+
+        ingest_old_ms = await timed_async(lambda: ingest_old(db, body))
+        ingest_new_ms = await timed_async(lambda: ingest_new(db, body))
+
+        old_id, new_id = str(uuid.uuid4()), str(uuid.uuid4())
+        data = SessionCreate.model_validate_json(body)
+        await db.execute("INSERT INTO old_sessions (session_id, notes_json) VALUES (?, ?)", (old_id, json.dumps(data.notes)))
+        await insert_notes(db, new_id, 0, data.notes)
+        await db.commit()
+
+        serve_old_ms = await timed_async(lambda: serve_old(db, old_id))
+        serve_new_ms = await timed_async(lambda: serve_new(db, new_id))
+        served = await serve_new(db, new_id)
+    return ingest_old_ms, ingest_new_ms, serve_old_ms, serve_new_ms, served
+
+# --- ENDPOINTS (full request through FastAPI, new code only) ---
+def bench_endpoints(client, headers, body):
+    post = timed(lambda: client.post("/api/sessions", content=body, headers={**headers, "Content-Type": "application/json"}))
+    # Each size gets a newer createdAt, so /api/notes serves a session of this size
+    get = timed(lambda: client.get("/api/notes", headers={**headers, "Accept-Encoding": "identity"}))
+    return post, get
+
+if __name__ == "__main__":
+    with TestClient(api.app) as client:
+        client.post("/api/auth/register", json={"email": "bench@example.com", "password": "bench"})
+        token = client.post("/api/auth/login", json={"email": "bench@example.com", "password": "bench"}).json()["token"]
+        headers = {"Authorization": f"Bearer {token}"}
+
+        print(f"{'notes':>7} | {'ingest old':>10} {'ingest new':>10} | {'serve old':>9} {'serve new':>9}"
+              f" | {'POST':>8} {'GET':>8} | {'raw KB':>7} {'gzip KB':>7} {'gzip ms':>7}")
+        for n in SIZES:
+            body = make_payload(n)
+            ingest_old_ms, ingest_new_ms, serve_old_ms, serve_new_ms, served = asyncio.run(bench_storage(body))
+            post_ms, get_ms = bench_endpoints(client, headers, body)
+
+            print(f"{n:>7} | {ingest_old_ms:>8.1f}ms {ingest_new_ms:>8.1f}ms"
+                  f" | {serve_old_ms:>7.1f}ms {serve_new_ms:>7.1f}ms"
+                  f" | {post_ms:>6.1f}ms {get_ms:>6.1f}ms"
+                  f" | {len(served) / 1024:>7.0f} {len(gzip.compress(served, 6)) / 1024:>7.0f}"
+                  f" {timed(lambda: gzip.compress(served, 6)):>7.1f}")
+    shutil.rmtree(BENCH_DIR, ignore_errors=True)
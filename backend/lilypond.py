@@ -1,8 +1,9 @@
 import asyncio
 import subprocess
 import os
-import uuid
+import shutil
 import sys
+import tempfile
 import traceback
 
 def parse_vexflow_duration(duration_str):
@@ -116,15 +117,17 @@ def edit_notes(notes):
             
     return lily_string.strip()
 
-async def convert_to_lilypond(notes):
-    unique_id = str(uuid.uuid4())
-    base_filename = f"temp_{unique_id}"
-    ly_filename = f"{base_filename}.ly"
-    pdf_filename = f"{base_filename}.pdf"
+# --- BATCHING ---
+# LilyPond/Guile startup dominates short renders, so exports that arrive close
+# together are rendered by one `lilypond` run over several input files.
+BATCH_WINDOW = 0.05          # Seconds to wait for more exports after the first
+MAX_BATCH_SIZE = 16
+MAX_CONCURRENT_RENDERS = os.cpu_count() or 2
 
+def build_lilypond_source(notes):
     music_notes = edit_notes(notes)
     
-    lilypond_content = f"""
+    return f"""
 \\version "2.24.0"
 \\score {{
   \\new Staff {{
@@ -139,46 +142,134 @@ async def convert_to_lilypond(notes):
 }}
 """
 
+def split_log_by_file(log, filenames):
+    """
+    LilyPond prints "Processing `name.ly'" before each input file, so the
+    messages for a file are the lines between its marker and the next one.
+    """
+    per_file = {name: [] for name in filenames}
+    current = None
+    for line in log.splitlines():
+        if line.startswith("Processing `"):
+            name = line[len("Processing `"):].rstrip("'")
+            current = name if name in per_file else None
+        elif current:
+            per_file[current].append(line)
+    return {name: "\n".join(lines) for name, lines in per_file.items()}
+
+async def render_batch(sources):
+    """
+    Renders several LilyPond sources with a single `lilypond` invocation.
+    Returns one (pdf_bytes, error_msg) pair per source, in order.
+    """
+    job_dir = tempfile.mkdtemp(prefix="lilypond_job_")
+    names = [f"score_{i}" for i in range(len(sources))]
+    ly_files = [f"{name}.ly" for name in names]
+
     try:
-        with open(ly_filename, "w") as f:
-            f.write(lilypond_content)
+        for ly_filename, content in zip(ly_files, sources):
+            with open(os.path.join(job_dir, ly_filename), "w") as f:
+                f.write(content)
 
-        cmd = ["lilypond", "--output", base_filename, ly_filename]
+        cmd = ["lilypond", *ly_files]
         
         if sys.platform == "win32":
             process = await asyncio.to_thread(
-                subprocess.run, cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=False
+                subprocess.run, cmd, cwd=job_dir, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=False
             )
             returncode = process.returncode
             stderr = process.stderr
         else:
             process = await asyncio.create_subprocess_exec(
-                *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+                *cmd, cwd=job_dir, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
             )
             stdout, stderr = await process.communicate()
             returncode = process.returncode
 
+        log = stderr.decode(errors="replace")
         if returncode != 0:
-            error_msg = stderr.decode()
-            print(f"LILYPOND ERROR:\n{error_msg}")
-            return None, f"LilyPond Error: {error_msg}"
-
-        if os.path.exists(pdf_filename):
-            with open(pdf_filename, "rb") as f:
-                pdf_bytes = f.read()
-            return pdf_bytes, None
-        else:
-            return None, "PDF created but file not found."
+            print(f"LILYPOND ERROR:\n{log}")
+        file_logs = split_log_by_file(log, ly_files)
+
+        results = []
+        for name, ly_filename in zip(names, ly_files):
+            pdf_filename = os.path.join(job_dir, f"{name}.pdf")
+            if os.path.exists(pdf_filename):
+                with open(pdf_filename, "rb") as f:
+                    results.append((f.read(), None))
+            elif returncode != 0:
+                results.append((None, f"LilyPond Error: {file_logs[ly_filename] or log}"))
+            else:
+                results.append((None, "PDF created but file not found."))
+        return results
 
     except Exception:
         full_error = traceback.format_exc()
         print(f"CRITICAL ERROR:\n{full_error}")
-        return None, f"Server Error: {full_error}"
+        return [(None, f"Server Error: {full_error}")] * len(sources)
 
     finally:
-        if os.path.exists(ly_filename):
-            os.remove(ly_filename)
-        if os.path.exists(pdf_filename):
-            os.remove(pdf_filename)
-        if os.path.exists(f"{base_filename}.log"):
-            os.remove(f"{base_filename}.log")
\ No newline at end of file
+        shutil.rmtree(job_dir, ignore_errors=True)
+
+class LilyPondBatcher:
+    """
+    Collects render requests for up to BATCH_WINDOW seconds (or MAX_BATCH_SIZE
+    requests) and hands each group to render_batch. Each caller awaits its
+    own result.
+    """
+
+    def __init__(self):
+        self._queue = None
+        self._worker = None
+        self._slots = None
+        self._renders = set()  # Running render tasks; the loop only keeps weak references
+
+    async def render(self, source):
+        self._ensure_worker()
+        result = asyncio.get_running_loop().create_future()
+        await self._queue.put((source, result))
+        return await result
+
+    def _ensure_worker(self):
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._slots = asyncio.Semaphore(MAX_CONCURRENT_RENDERS)
+            self._worker = asyncio.ensure_future(self._collect())
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + BATCH_WINDOW
+            while len(batch) < MAX_BATCH_SIZE:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            # Keep collecting the next batch while this one renders
+            await self._slots.acquire()
+            task = asyncio.ensure_future(self._render(batch))
+            self._renders.add(task)
+            task.add_done_callback(self._renders.discard)
+
+    async def _render(self, batch):
+        try:
+            results = await render_batch([source for source, _ in batch])
+            for (_, future), result in zip(batch, results):
+                if not future.done():  # The request may have been cancelled
+                    future.set_result(result)
+        finally:
+            self._slots.release()
+            # Cancelled or crashed: fail whoever is still waiting instead of leaving them hanging
+            for _, future in batch:
+                if not future.done():
+                    future.set_result((None, "Server Error: PDF render was interrupted."))
+
+_batcher = LilyPondBatcher()
+
+async def convert_to_lilypond(notes):
+    return await _batcher.render(build_lilypond_source(notes))
@@ -0,0 +1,166 @@
+# notation.py
+import uuid
+from note_store import NOTE_NAMES
+
+# VexFlow keys for every MIDI number, e.g. 61 -> "c#/4"
+VEX_KEYS = tuple(f"{NOTE_NAMES[m % 12].lower()}/{(m // 12) - 1}" for m in range(128))
+
+def quantize_duration(seconds, bpm):
+    """
+    Converts raw play time into the nearest musical duration based on BPM.
+    Mirrors quantizeDuration in src/utils/musicMath.ts.
+    """
+    num_beats = seconds / (60 / bpm)
+
+    if num_beats < 0.29: return '16'
+    if num_beats < 0.38: return '8r'
+    if num_beats < 0.62: return '8'
+    if num_beats < 0.88: return 'qr'
+    if num_beats < 1.30: return 'q'
+    if num_beats < 1.75: return 'qd'
+    if num_beats < 2.5:  return 'h'
+    if num_beats < 3.5:  return 'hd'
+    return 'w'
+
+DURATION_BEATS = {
+    'w': 4, 'hd': 3, 'h': 2, 'qd': 1.5, 'q': 1, 'qr': 2/3,
+    '8d': 0.75, '8': 0.5, '8r': 1/3, '16': 0.25,
+}
+
+def get_duration_value(duration):
+    """Beats per duration code. Mirrors getDurationValue in src/utils/musicMath.ts."""
+    return DURATION_BEATS.get(duration, 0)
+
+# --- MEASURE QUANTIZATION ---
+BEATS_PER_MEASURE = 4
+GRID = 0.25        # Onsets snap to 16th notes
+REST_KEY = "b/4"   # Staff position VexFlow uses for rests
+
+# Durations that can be written without ties, longest first, in grid slots
+WRITTEN_DURATIONS = [
+    (int(DURATION_BEATS[code] / GRID), code) for code in ('w', 'hd', 'h', 'qd', 'q', '8d', '8', '16')
+]
+
+class IncrementalQuantizer:
+    """
+    Turns finished notes into NoteData entries one measure at a time.
+    Notes are snapped to a 16th grid, notes starting on the same slot become
+    a chord, and gaps become rests, so every emitted measure is full.
+
+    A measure is only emitted once it is settled, i.e. no note that could
+    still start inside it is pending. Callers pass that horizon to settle().
+    """
+
+    def __init__(self, bpm, start_time=0.0):
+        self.bpm = bpm
+        self.beat_seconds = 60 / bpm
+        self.slot_seconds = GRID * self.beat_seconds
+        self.slots_per_measure = int(BEATS_PER_MEASURE / GRID)
+        self.measure_seconds = BEATS_PER_MEASURE * self.beat_seconds
+        # Resumed takes continue after the measures that were already emitted
+        # (rounded first: a logged measure_start() must not spill into the next measure)
+        self.next_measure = -int(-round(start_time / self.measure_seconds, 6) // 1)
+        self._pending = {}  # measure -> [(slot, midi, duration_seconds)]
+
+    def add(self, midi, start_time, duration):
+        slot = round(start_time / self.slot_seconds)
+        measure, slot = divmod(slot, self.slots_per_measure)
+        if measure < self.next_measure:
+            # Already emitted; fold the note into the first open measure
+            measure, slot = self.next_measure, 0
+        self._pending.setdefault(measure, []).append((slot, midi, duration))
+
+    def settle(self, horizon):
+        """
+        Emits every measure whose notes are final, given that no note can
+        still start before `horizon` seconds. Returns [(measure, notes)].
+        """
+        settled = []
+        # Half a slot of slack: a note starting just before the barline snaps into the next measure
+        while (self.next_measure + 1) * self.measure_seconds + self.slot_seconds / 2 <= horizon:
+            settled.append(self._emit_next())
+        return settled
+
+    def measure_start(self, measure):
+        """Time (seconds) of the barline that opens `measure`."""
+        return measure * self.measure_seconds
+
+    def measure_end(self, measure):
+        """Notes starting before this time (seconds) land in `measure` or earlier."""
+        return (measure + 1) * self.measure_seconds - self.slot_seconds / 2
+
+    def flush(self):
+        """Emits everything left, padding the last measure with rests."""
+        settled = []
+        while self._pending:
+            settled.append(self._emit_next())
+        return settled
+
+    def _emit_next(self):
+        measure = self.next_measure
+        self.next_measure += 1
+        return measure, self._render_measure(measure, self._pending.pop(measure, []))
+
+    def _render_measure(self, measure, entries):
+        chords = {}
+        for slot, midi, duration in entries:
+            chord = chords.setdefault(slot, {"midis": set(), "duration": 0.0})
+            chord["midis"].add(midi)
+            chord["duration"] = max(chord["duration"], duration)
+
+        notes = []
+        cursor = 0
+        onsets = sorted(chords)
+        for i, slot in enumerate(onsets):
+            if slot > cursor:
+                notes += self._rests(measure, cursor, slot - cursor)
+
+            chord = chords[slot]
+            next_onset = onsets[i + 1] if i + 1 < len(onsets) else self.slots_per_measure
+            wanted = max(1, round(get_duration_value(quantize_duration(chord["duration"], self.bpm)) / GRID))
+            slots, code = _longest_written(min(wanted, next_onset - slot))
+
+            notes.append(self._note_data(
+                measure, slot, code, sorted(chord["midis"]), chord["duration"]
+            ))
+            cursor = slot + slots
+
+        if cursor < self.slots_per_measure:
+            notes += self._rests(measure, cursor, self.slots_per_measure - cursor)
+        return notes
+
+    def _rests(self, measure, slot, length):
+        rests = []
+        while length > 0:
+            slots, code = _longest_written(length)
+            rests.append(self._note_data(measure, slot, code, None, slots * self.slot_seconds))
+            slot += slots
+            length -= slots
+        return rests
+
+    def _note_data(self, measure, slot, code, midis, raw_duration):
+        return {
+            "id": str(uuid.uuid4()),
+            "keys": [VEX_KEYS[m] for m in midis] if midis else [REST_KEY],
+            "duration": code,
+            "rawDuration": round(raw_duration, 3),
+            "startTimeOffset": round((measure * self.slots_per_measure + slot) * self.slot_seconds, 3),
+            "isRest": not midis,
+            "color": "black",
+        }
+
+def _longest_written(slots):
+    for length, code in WRITTEN_DURATIONS:
+        if length <= slots:
+            return length, code
+    return WRITTEN_DURATIONS[-1]
+
+def quantize_notes(rows, bpm):
+    """
+    Quantizes a whole take of (midi, start_time, duration) rows into
+    NoteData dicts, using the same measure logic as the live stream.
+    """
+    quantizer = IncrementalQuantizer(bpm)
+    for midi, start_time, duration in rows:
+        quantizer.add(midi, start_time, duration)
+    return [note for _, notes in quantizer.flush() for note in notes]
@@ -0,0 +1,107 @@
+# note_store.py
+from array import array
+
+NOTE_NAMES = ["C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B"]
+
+# Precomputed "C#4"-style names for every MIDI number, so hot paths never
+# format strings; names are only looked up when an event is serialized.
+NOTE_NAME_TABLE = tuple(f"{NOTE_NAMES[m % 12]}{(m // 12) - 1}" for m in range(128))
+
+PIANO_LOW = 21    # A0, first of the 88 keys the model outputs
+PIANO_KEYS = 88
+_SILENT = float("nan")
+
+
+class NoteEventStore:
+    """
+    Finished notes stored as three typed columns (midi, start, duration)
+    instead of one dict per note. Columns grow amortized and hold raw
+    values only, so no per-note Python objects are kept alive.
+    """
+
+    __slots__ = ("midi", "start", "duration")
+
+    def __init__(self):
+        self.midi = array("B")
+        self.start = array("d")
+        self.duration = array("d")
+
+    def __len__(self):
+        return len(self.midi)
+
+    def append(self, midi, start, duration):
+        self.midi.append(midi)
+        self.start.append(start)
+        self.duration.append(duration)
+
+    def extend(self, other):
+        self.midi.extend(other.midi)
+        self.start.extend(other.start)
+        self.duration.extend(other.duration)
+
+    def clear(self):
+        del self.midi[:]
+        del self.start[:]
+        del self.duration[:]
+
+    def rows(self, first_seq=0):
+        """(seq, midi, start, duration) tuples, e.g. for executemany."""
+        return list(zip(range(first_seq, first_seq + len(self)), self.midi, self.start, self.duration))
+
+
+class ActiveNotes:
+    """
+    Start times of the currently sounding notes, one fixed slot per piano key
+    (NaN = silent). Supports the dict operations the live handler uses,
+    keyed by MIDI number.
+    """
+
+    __slots__ = ("_start", "_count")
+
+    def __init__(self):
+        self._start = array("d", [_SILENT]) * PIANO_KEYS
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, midi):
+        start = self._start[midi - PIANO_LOW]
+        return start == start  # NaN != NaN
+
+    def __getitem__(self, midi):
+        start = self._start[midi - PIANO_LOW]
+        if start != start:
+            raise KeyError(midi)
+        return start
+
+    def __setitem__(self, midi, start_time):
+        slot = midi - PIANO_LOW
+        if self._start[slot] != self._start[slot]:
+            self._count += 1
+        self._start[slot] = start_time
+
+    def __delitem__(self, midi):
+        slot = midi - PIANO_LOW
+        if self._start[slot] != self._start[slot]:
+            raise KeyError(midi)
+        self._start[slot] = _SILENT
+        self._count -= 1
+
+    def keys(self):
+        return [slot + PIANO_LOW for slot, start in enumerate(self._start) if start == start]
+
+    def items(self):
+        return [(slot + PIANO_LOW, start) for slot, start in enumerate(self._start) if start == start]
+
+    def earliest(self):
+        """Start time of the longest-sounding note, or None if all are silent."""
+        if not self._count:
+            return None
+        return min(start for start in self._start if start == start)
+
+    def clear(self):
+        if self._count:
+            for slot in range(PIANO_KEYS):
+                self._start[slot] = _SILENT
+            self._count = 0
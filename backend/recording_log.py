@@ -0,0 +1,283 @@
+# recording_log.py
+import asyncio
+import os
+import secrets
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from note_store import NoteEventStore
+
+# --- CONFIGURATION ---
+FLUSH_BATCH_SIZE = 32     # Flush as soon as this many finished notes are pending
+FLUSH_INTERVAL = 1.0      # ...or at least this often (seconds) while notes are pending
+MAX_PENDING_NOTES = 512   # Past this, the handler waits for the disk to catch up
+FLUSH_RETRY_DELAYS = (0.5, 1.0, 2.0, 4.0, 8.0)  # Backoff between attempts at a failing batch
+RECORDING_TTL_HOURS = float(os.getenv("RECORDING_TTL_HOURS", "24"))  # Idle recordings are deleted after this
+EXPIRE_INTERVAL = 3600    # Seconds between expiry sweeps
+
+# --- CLOSE CODES (the front end maps these to messages) ---
+CLOSE_TAKEN_OVER = 4409      # A reconnect resumed this recording on a new connection
+CLOSE_LOG_FAILED = 1011      # The recording log kept failing, the take cannot be saved
+
+# Shared with api.py, which creates the same tables on startup
+LIVE_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS live_recordings (
+        token TEXT PRIMARY KEY,
+        user_id TEXT NOT NULL,
+        note_count INTEGER DEFAULT 0,
+        elapsed REAL DEFAULT 0,
+        settled REAL DEFAULT 0,
+        session_id TEXT,
+        created_at TEXT,
+        updated_at TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS live_notes (
+        token TEXT NOT NULL,
+        seq INTEGER NOT NULL,
+        midi INTEGER NOT NULL,
+        start_time REAL NOT NULL,
+        duration REAL NOT NULL,
+        PRIMARY KEY (token, seq)
+    )
+    """,
+]
+
+# Columns added after the tables first shipped: (table, column, type)
+LIVE_ADDED_COLUMNS = [("live_recordings", "user_id", "TEXT"), ("live_recordings", "settled", "REAL DEFAULT 0")]
+
+
+class RecordingBusy(Exception):
+    """The recording is still held by another open connection."""
+
+
+class RecordingLogError(Exception):
+    """The log keeps failing and the pending notes hit MAX_PENDING_NOTES."""
+
+
+class RecordingLog:
+    """
+    Durable per-session log of finished live notes, stored in SQLite.
+    All database work runs on a single background thread.
+    """
+
+    def __init__(self, db_path):
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="recording-log")
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")  # api.py reads while we append
+        for statement in LIVE_SCHEMA:
+            self._conn.execute(statement)
+        for table, column, kind in LIVE_ADDED_COLUMNS:
+            columns = {row[1] for row in self._conn.execute(f"PRAGMA table_info({table})")}
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {kind}")
+        self._conn.commit()
+        self._held = set()  # Tokens with an open SessionWriter (touched on the event loop only)
+
+    async def _run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, fn, *args)
+
+    async def open_session(self, user_id, token=None):
+        """
+        Resumes `user_id`'s recording for `token` if it exists and has not been
+        saved yet, otherwise starts a new one. Returns (token, note_count, elapsed),
+        where `elapsed` is past both the last logged note and the last measure
+        sent to the client, i.e. where a resumed take continues.
+        Raises RecordingBusy if another connection still holds `token`; the
+        token stays held until the SessionWriter for it is closed.
+        """
+        if token in self._held:
+            raise RecordingBusy(token)
+        if token:
+            self._held.add(token)  # Reserve before awaiting, so a racing resume is refused
+        try:
+            opened = await self._run(self._open_session, user_id, token)
+        except BaseException:
+            self._held.discard(token)
+            raise
+        if opened[0] != token:
+            self._held.discard(token)
+            self._held.add(opened[0])
+        return opened
+
+    def is_held(self, token):
+        return token in self._held
+
+    def release(self, token):
+        self._held.discard(token)
+
+    def _open_session(self, user_id, token):
+        now = datetime.now().isoformat()
+        with self._lock, self._conn:  # Commits on success, rolls back on error
+            if token:
+                row = self._conn.execute(
+                    "SELECT note_count, MAX(elapsed, settled) FROM live_recordings WHERE token = ? AND user_id = ? AND session_id IS NULL",
+                    (token, user_id)
+                ).fetchone()
+                if row:
+                    self._conn.execute("UPDATE live_recordings SET updated_at = ? WHERE token = ?", (now, token))
+                    return token, row[0], row[1]
+
+            token = secrets.token_urlsafe(16)
+            self._conn.execute(
+                "INSERT INTO live_recordings (token, user_id, created_at, updated_at) VALUES (?, ?, ?, ?)",
+                (token, user_id, now, now)
+            )
+            return token, 0, 0.0
+
+    def append_notes(self, token, rows, settled=0.0):
+        """
+        rows: list of (seq, midi, start_time, duration), possibly empty.
+        settled: how far (seconds) the measures sent to the client reach.
+        Runs on the log thread.
+        """
+        last_seq = max((r[0] for r in rows), default=-1)
+        end = max((r[2] + r[3] for r in rows), default=0.0)
+        # A failed batch must leave nothing behind, or its retry hits the primary key
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT INTO live_notes (token, seq, midi, start_time, duration) VALUES (?, ?, ?, ?, ?)",
+                [(token, *r) for r in rows]
+            )
+            self._conn.execute("""
+                UPDATE live_recordings
+                SET note_count = MAX(note_count, ?), elapsed = MAX(elapsed, ?), settled = MAX(settled, ?), updated_at = ?
+                WHERE token = ?
+            """, (last_seq + 1, end, settled, datetime.now().isoformat(), token))
+
+
+    async def expire(self, max_age_hours=RECORDING_TTL_HOURS):
+        """
+        Deletes recordings (and their notes) untouched for `max_age_hours`,
+        saved or not, except ones an open connection still holds.
+        Returns how many were deleted.
+        """
+        cutoff = (datetime.now() - timedelta(hours=max_age_hours)).isoformat()
+        return await self._run(self._expire, cutoff, set(self._held))
+
+    def _expire(self, cutoff, held):
+        with self._lock, self._conn:
+            rows = self._conn.execute("SELECT token FROM live_recordings WHERE updated_at < ?", (cutoff,)).fetchall()
+            stale = [(token,) for token, in rows if token not in held]
+            self._conn.executemany("DELETE FROM live_notes WHERE token = ?", stale)
+            self._conn.executemany("DELETE FROM live_recordings WHERE token = ?", stale)
+            return len(stale)
+
+    async def expire_periodically(self):
+        while True:
+            try:
+                removed = await self.expire()
+                if removed:
+                    print(f"Recording log: expired {removed} idle recordings")
+            except Exception as e:
+                print(f"Recording log expiry error: {e}")
+            await asyncio.sleep(EXPIRE_INTERVAL)
+
+
+class SessionWriter:
+    """
+    Write-behind buffer for one connection. Finished notes are batched in
+    memory and flushed to the RecordingLog in the background, so memory stays
+    bounded no matter how long the take runs. Two NoteEventStores are swapped
+    between "filling" and "flushing" so new notes never wait on the disk.
+
+    A failing batch is retried with backoff. If the log is still failing once
+    MAX_PENDING_NOTES are waiting, backpressure() raises RecordingLogError
+    rather than letting the buffer grow.
+    """
+
+    def __init__(self, log, token, note_count=0, elapsed=0.0):
+        self.log = log
+        self.token = token
+        self.note_count = note_count
+        self.time_offset = elapsed  # Resumed takes continue after the logged audio
+        self._settled = elapsed     # How far the measures sent to the client reach (seconds)
+        self._saved_settled = elapsed
+        self._pending = NoteEventStore()
+        self._spare = NoteEventStore()
+        self._pending_seq = note_count  # seq of the first pending note
+        self._flush_task = None
+        self._failures = 0               # Consecutive failed flush attempts
+        self._progress = asyncio.Event()  # Set after every flush attempt
+        self._closed = asyncio.get_running_loop().create_future()
+        self._ticker = asyncio.ensure_future(self._flush_periodically())
+
+    def add(self, midi, start_time, duration):
+        self._pending.append(midi, start_time, duration)
+        self.note_count += 1
+        if len(self._pending) >= FLUSH_BATCH_SIZE:
+            self._start_flush()
+
+    def settle(self, until):
+        """Measures up to `until` seconds were sent; a resumed take starts after them."""
+        self._settled = max(self._settled, until)
+
+    async def backpressure(self):
+        # Only blocks the handler if the disk has fallen far behind
+        while len(self._pending) >= MAX_PENDING_NOTES:
+            if self._failures:
+                raise RecordingLogError(f"{len(self._pending)} notes pending and the recording log is failing")
+            self._start_flush()
+            self._progress.clear()
+            await self._progress.wait()
+
+    def _start_flush(self):
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.ensure_future(self._flush())
+
+    async def _flush(self):
+        attempts = 0
+        while len(self._pending) or self._settled > self._saved_settled:
+            batch, self._pending = self._pending, self._spare
+            first_seq = self._pending_seq
+            self._pending_seq += len(batch)
+            settled = self._settled
+            try:
+                await self.log._run(self.log.append_notes, self.token, batch.rows(first_seq), settled)
+            except Exception as e:
+                print(f"Recording log error: {e}")
+                # Put the failed batch back in front of anything added meanwhile
+                batch.extend(self._pending)
+                self._pending.clear()
+                self._spare, self._pending = self._pending, batch
+                self._pending_seq = first_seq
+                self._failures += 1
+                self._progress.set()
+                if attempts == len(FLUSH_RETRY_DELAYS):
+                    return  # Give up for now; the next add or tick starts over
+                await asyncio.sleep(FLUSH_RETRY_DELAYS[attempts])
+                attempts += 1
+                continue
+            batch.clear()
+            self._spare = batch
+            self._saved_settled = settled
+            self._failures = 0
+            attempts = 0
+            self._progress.set()
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL)
+            if self._pending or self._settled > self._saved_settled:
+                self._start_flush()
+
+    async def close(self):
+        self._ticker.cancel()
+        try:
+            if self._flush_task:
+                await self._flush_task
+            await self._flush()
+            if len(self._pending):
+                print(f"Recording log: dropped {len(self._pending)} unsaved notes for {self.token}")
+        finally:
+            self.log.release(self.token)
+            if not self._closed.done():
+                self._closed.set_result(None)
+
+    async def wait_closed(self):
+        await asyncio.shield(self._closed)
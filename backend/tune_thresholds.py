@@ -0,0 +1,300 @@
+# tune_thresholds.py
+"""
+Offline tuning of the live note-detection thresholds in audio.py.
+
+  1. cache: run the model once over a corpus of recordings and store the
+     per-hop note/onset activations the live handler would see, as .npy files.
+  2. sweep: replay the live decision logic over those cached activations for
+     a whole grid of threshold combinations at once, score each against
+     reference annotations, and export the best one as thresholds.json.
+
+Corpus layout: <name>.wav plus <name>.csv with one reference note per line,
+"onset_seconds,offset_seconds,midi" (a header line is allowed).
+
+  python tune_thresholds.py cache corpus/ cache/
+  python tune_thresholds.py sweep corpus/ cache/ --out thresholds.json
+"""
+import argparse
+import itertools
+import json
+import os
+import time
+
+import numpy as np
+
+from audio import (
+    SAMPLE_RATE, HOP_SIZE, WINDOW_LENGTH, MIN_VOLUME, FOCUS_FRAMES, TUNABLE_PARAMS,
+    load_basic_pitch_predictor,
+)
+
+PREDICT_BATCH_SIZE = 16
+ONSET_TOLERANCE = 0.1  # Seconds; covers the hop size plus the FOCUS_FRAMES look-back
+
+DEFAULT_GRID = {
+    "ONSET_THRESHOLD": np.linspace(0.3, 0.9, 7),
+    "RETRIGGER_ONSET_THRESHOLD": np.linspace(0.6, 0.95, 6),
+    "NOTE_START_THRESHOLD": np.linspace(0.3, 0.7, 5),
+    "NOTE_KEEP_THRESHOLD": np.linspace(0.1, 0.4, 4),
+    "RETRIGGER_COOLDOWN": np.linspace(0.05, 0.25, 5),
+}
+
+# --- ACTIVATION CACHE ---
+def suppress_overtones(notes):
+    """
+    The suppression pass from audio_handler, applied to every hop at once.
+    notes: (n_hops, 88) per-hop note maxima, modified in place.
+    """
+    for i in range(87, 24, -1):
+        prob = notes[:, i].copy()
+        candidate = prob >= 0.1
+
+        # CHECK 1: AM I AN OVERTONE?
+        prob_below = notes[:, i - 12]
+        overtone = candidate & (prob_below > 0.5) & (prob < prob_below)
+        notes[overtone, i] = 0.0
+
+        # CHECK 2: AM I CAUSING GHOSTS?
+        strong = candidate & ~overtone & (prob > 0.5)
+        for offset in (12, 19):
+            low_idx = i - offset
+            ghost = strong & (notes[:, low_idx] < prob * 0.9)
+            notes[ghost, low_idx] = 0.0
+    return notes
+
+def compute_activations(predict, audio):
+    """
+    Feeds the recording through the model hop by hop, exactly as the live
+    handler's rolling buffer would, but in batches.
+    Returns (note, onset, volume) with one row per hop.
+    """
+    n_hops = len(audio) // HOP_SIZE
+    padded = np.concatenate([np.zeros(WINDOW_LENGTH - HOP_SIZE, dtype=np.float32), audio])
+    windows = np.lib.stride_tricks.sliding_window_view(padded, WINDOW_LENGTH)[::HOP_SIZE][:n_hops]
+
+    hops = audio[:n_hops * HOP_SIZE].reshape(n_hops, HOP_SIZE)
+    volume = np.sqrt(np.mean(hops ** 2, axis=1)).astype(np.float32)
+
+    note = np.zeros((n_hops, 88), dtype=np.float32)
+    onset = np.zeros((n_hops, 88), dtype=np.float32)
+    loud = np.flatnonzero(volume >= MIN_VOLUME)  # Silent hops never reach the model live
+
+    for b in range(0, len(loud), PREDICT_BATCH_SIZE):
+        idx = loud[b:b + PREDICT_BATCH_SIZE]
+        output = predict(windows[idx][..., np.newaxis])
+        note[idx] = np.max(np.asarray(output['note'])[:, -FOCUS_FRAMES:, :], axis=1)
+        onset[idx] = np.max(np.asarray(output['onset'])[:, -FOCUS_FRAMES:, :], axis=1)
+
+    return suppress_overtones(note), onset, volume
+
+def cache_paths(cache_dir, name):
+    return {kind: os.path.join(cache_dir, f"{name}.{kind}.npy") for kind in ("note", "onset", "volume")}
+
+def build_cache(corpus_dir, cache_dir, force=False):
+    import librosa
+
+    os.makedirs(cache_dir, exist_ok=True)
+    predict = None
+    for name in list_recordings(corpus_dir):
+        paths = cache_paths(cache_dir, name)
+        if not force and all(os.path.exists(p) for p in paths.values()):
+            continue
+        if predict is None:
+            predict = load_basic_pitch_predictor()
+
+        t0 = time.perf_counter()
+        audio, _ = librosa.load(os.path.join(corpus_dir, f"{name}.wav"), sr=SAMPLE_RATE, mono=True)
+        note, onset, volume = compute_activations(predict, audio.astype(np.float32))
+        np.save(paths["note"], note)
+        np.save(paths["onset"], onset)
+        np.save(paths["volume"], volume)
+        print(f"Cached {name}: {len(volume)} hops in {time.perf_counter() - t0:.1f}s")
+
+def load_cache(cache_dir, name):
+    paths = cache_paths(cache_dir, name)
+    return tuple(np.load(paths[kind], mmap_mode="r") for kind in ("note", "onset", "volume"))
+
+# --- CORPUS ---
+def list_recordings(corpus_dir):
+    return sorted(
+        f[:-4] for f in os.listdir(corpus_dir)
+        if f.endswith(".wav") and os.path.exists(os.path.join(corpus_dir, f[:-4] + ".csv"))
+    )
+
+def load_reference(corpus_dir, name):
+    """Returns (midi, onset) arrays of the annotated notes."""
+    midi, onset = [], []
+    with open(os.path.join(corpus_dir, f"{name}.csv")) as f:
+        for line in f:
+            parts = line.strip().split(",")
+            try:
+                onset.append(float(parts[0]))
+                midi.append(int(float(parts[2])))
+            except (ValueError, IndexError):
+                continue  # Header or blank line
+    return np.array(midi, dtype=np.int64), np.array(onset)
+
+# --- VECTORIZED DECISION LOGIC ---
+def build_grid(grid):
+    combos = np.array(list(itertools.product(*(grid[name] for name in TUNABLE_PARAMS))))
+    params = dict(zip(TUNABLE_PARAMS, combos.T))
+    # Keeping a note alive more easily than starting one is what the hysteresis is for
+    valid = params["NOTE_KEEP_THRESHOLD"] <= params["NOTE_START_THRESHOLD"]
+    return {name: values[valid][:, np.newaxis] for name, values in params.items()}
+
+def simulate(params, note, onset, volume):
+    """
+    Replays audio_handler's hysteresis / retrigger / cooldown logic for every
+    configuration at once; state is a (configs, 88) array per variable.
+    Returns (config_index, midi, onset_seconds) of every detected note.
+    """
+    n_configs = len(params["ONSET_THRESHOLD"])
+    active = np.zeros((n_configs, 88), dtype=bool)
+    start = np.zeros((n_configs, 88))
+    found = []
+
+    def emit(mask):
+        cfg, key = np.nonzero(mask)
+        found.append((cfg, key + 21, start[cfg, key]))
+
+    for t in range(len(volume)):
+        now = (t + 1) * HOP_SIZE / SAMPLE_RATE  # When this hop's audio has fully arrived
+
+        # --- SILENCE HANDLING ---
+        if volume[t] < MIN_VOLUME:
+            if active.any():
+                emit(active)
+                active[:] = False
+            continue
+
+        thresh = np.where(active, params["NOTE_KEEP_THRESHOLD"], params["NOTE_START_THRESHOLD"])
+        sustaining = note[t] > thresh
+
+        # Re-trigger: close the old instance and start a new one
+        retrigger = (
+            active & sustaining
+            & (onset[t] > params["RETRIGGER_ONSET_THRESHOLD"])
+            & ((now - start) > params["RETRIGGER_COOLDOWN"])
+        )
+        if retrigger.any():
+            emit(retrigger)
+            start[retrigger] = now
+
+        new = ~active & sustaining & (onset[t] > params["ONSET_THRESHOLD"])
+        start[new] = now
+        active |= new
+
+        # --- CLEANUP ---
+        ended = active & ~sustaining
+        if ended.any():
+            emit(ended)
+            active &= ~ended
+
+    if active.any():
+        emit(active)
+
+    if not found:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+    cfg, midi, onsets = (np.concatenate(parts) for parts in zip(*found))
+    return cfg, midi, onsets
+
+def count_matches(n_configs, est_cfg, est_midi, est_onset, ref_midi, ref_onset):
+    """
+    Onset matching with ONSET_TOLERANCE and exact pitch, per configuration.
+    True positives are min(matched estimates, matched references), a cheap
+    stand-in for one-to-one matching that is exact when notes are not
+    closer together than the tolerance.
+    """
+    tol = int(round(ONSET_TOLERANCE * 1000))
+    n_est = np.bincount(est_cfg, minlength=n_configs)
+    if len(ref_midi) == 0 or len(est_cfg) == 0:
+        return np.zeros(n_configs, dtype=np.int64), n_est
+
+    est_ms = np.round(est_onset * 1000).astype(np.int64)
+    ref_ms = np.round(ref_onset * 1000).astype(np.int64)
+    span = int(max(est_ms.max(), ref_ms.max())) + 2 * tol + 1
+
+    def has_neighbour(sorted_keys, query):
+        pos = np.searchsorted(sorted_keys, query - tol)
+        pos = np.minimum(pos, len(sorted_keys) - 1)
+        return np.abs(sorted_keys[pos] - query) <= tol
+
+    # Estimates that hit some reference note
+    ref_keys = np.sort(ref_midi * span + ref_ms)
+    est_hits = np.bincount(est_cfg[has_neighbour(ref_keys, est_midi * span + est_ms)], minlength=n_configs)
+
+    # References that are hit by some estimate of the same configuration
+    est_keys = np.sort((est_cfg * 128 + est_midi) * span + est_ms)
+    cfg_grid = np.repeat(np.arange(n_configs), len(ref_midi))
+    queries = (cfg_grid * 128 + np.tile(ref_midi, n_configs)) * span + np.tile(ref_ms, n_configs)
+    ref_hits = np.bincount(cfg_grid[has_neighbour(est_keys, queries)], minlength=n_configs)
+
+    return np.minimum(est_hits, ref_hits), n_est
+
+def sweep(corpus_dir, cache_dir, grid):
+    params = build_grid(grid)
+    n_configs = len(params["ONSET_THRESHOLD"])
+    tp = np.zeros(n_configs)
+    n_est = np.zeros(n_configs)
+    n_ref = 0
+
+    print(f"Evaluating {n_configs} configurations...")
+    for name in list_recordings(corpus_dir):
+        t0 = time.perf_counter()
+        note, onset, volume = load_cache(cache_dir, name)
+        ref_midi, ref_onset = load_reference(corpus_dir, name)
+
+        cfg, midi, onsets = simulate(params, note, onset, volume)
+        hits, found = count_matches(n_configs, cfg, midi, onsets, ref_midi, ref_onset)
+        tp += hits
+        n_est += found
+        n_ref += len(ref_midi)
+        print(f"  {name}: {len(volume)} hops in {time.perf_counter() - t0:.1f}s")
+
+    precision = np.divide(tp, n_est, out=np.zeros(n_configs), where=n_est > 0)
+    recall = tp / n_ref if n_ref else np.zeros(n_configs)
+    f1 = np.divide(2 * tp, n_est + n_ref, out=np.zeros(n_configs), where=(n_est + n_ref) > 0)
+    return params, precision, recall, f1
+
+def export_best(params, precision, recall, f1, out_path, top=10):
+    order = np.argsort(-f1)
+    for rank, i in enumerate(order[:top], start=1):
+        values = ", ".join(f"{name}={params[name][i, 0]:.3f}" for name in TUNABLE_PARAMS)
+        print(f"{rank:>2}. F1={f1[i]:.3f} P={precision[i]:.3f} R={recall[i]:.3f}  {values}")
+
+    best = order[0]
+    config = {name: round(float(params[name][best, 0]), 4) for name in TUNABLE_PARAMS}
+    config["score"] = {"f1": float(f1[best]), "precision": float(precision[best]), "recall": float(recall[best])}
+    with open(out_path, "w") as f:
+        json.dump(config, f, indent=2)
+    print(f"Best configuration written to {out_path}")
+
+def parse_grid_overrides(overrides):
+    """--grid NAME=v1,v2,... replaces the default values for one parameter."""
+    grid = dict(DEFAULT_GRID)
+    for item in overrides:
+        name, _, values = item.partition("=")
+        if name not in grid:
+            raise SystemExit(f"Unknown parameter {name!r}; expected one of {', '.join(TUNABLE_PARAMS)}")
+        grid[name] = np.array([float(v) for v in values.split(",")])
+    return grid
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    cache_cmd = sub.add_parser("cache", help="Run the model once and cache per-hop activations")
+    cache_cmd.add_argument("corpus_dir")
+    cache_cmd.add_argument("cache_dir")
+    cache_cmd.add_argument("--force", action="store_true", help="Recompute existing cache entries")
+
+    sweep_cmd = sub.add_parser("sweep", help="Score a grid of thresholds against the cached activations")
+    sweep_cmd.add_argument("corpus_dir")
+    sweep_cmd.add_argument("cache_dir")
+    sweep_cmd.add_argument("--out", default="thresholds.json")
+    sweep_cmd.add_argument("--grid", action="append", default=[], metavar="NAME=v1,v2,...")
+
+    args = parser.parse_args()
+    if args.command == "cache":
+        build_cache(args.corpus_dir, args.cache_dir, force=args.force)
+    else:
+        export_best(*sweep(args.corpus_dir, args.cache_dir, parse_grid_overrides(args.grid)), args.out)
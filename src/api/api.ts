@@ -1,6 +1,6 @@
 // src/api/api.ts
 import axios from 'axios';
-import type { RenderedNote, SessionPayload } from '../types';
+import type { RenderedNote, SessionPayload, SessionPatchPayload, SessionSaveResponse } from '../types';
 
 const API_BASE_URL = 'http://localhost:5000/api';
 
@@ -113,7 +113,12 @@ export const listSessions = async () => {
 };
 
 export const saveSession = async (sessionData: SessionPayload) => {
-  const response = await apiClient.post('/sessions', sessionData);
+  const response = await apiClient.post<SessionSaveResponse>('/sessions', sessionData);
+  return response.data;
+};
+
+export const patchSession = async (sessionId: string, patch: SessionPatchPayload) => {
+  const response = await apiClient.patch<SessionSaveResponse>(`/sessions/${sessionId}`, patch);
   return response.data;
 };
 
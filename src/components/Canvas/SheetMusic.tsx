@@ -1,8 +1,9 @@
-import React, { useEffect, useRef } from 'react';
+import React, { useEffect, useMemo, useRef } from 'react';
 import { Renderer, Stave, Voice, Formatter } from 'vexflow';
+import type { RenderContext } from 'vexflow';
 import { useScoreStore, formatToVexKey } from '../../store/scoreStore';
 import { convertToVexNotes } from '../../utils/VexMap';
-import { quantizeDuration } from '../../utils/musicMath'; // Keep quantize, but we will count beats locally
+import { quantizeDuration } from '../../utils/musicMath'; // Only for the provisional live notes
 import type { RenderedNote } from '../../types';
 
 const MIN_STAVE_WIDTH = 250;
@@ -13,6 +14,13 @@ const BEATS_PER_MEASURE = 4;
 const MEASURE_BATCH_SIZE = 4;
 const NOTE_PADDING = 10; // Reduced padding so we rely on formatter
 
+// Where the next stave goes; `index` is its measure number in the score
+interface StavePosition {
+  x: number;
+  y: number;
+  index: number;
+}
+
 // Helper: Calculate exact beat value for measure grouping
 // 'q' = 1, 'h' = 2, '8' = 0.5, etc.
 const getNoteDuration = (durationString: string): number => {
@@ -37,12 +45,124 @@ const getNoteDuration = (durationString: string): number => {
   return value;
 };
 
+// Strict grouping: the server sends full measures, so this only splits them apart again
+const groupIntoMeasures = (notes: RenderedNote[]): RenderedNote[][] => {
+  const measures: RenderedNote[][] = [];
+  let currentMeasure: RenderedNote[] = [];
+  let currentBeats = 0;
+
+  notes.forEach((note) => {
+    const val = getNoteDuration(note.duration);
+
+    // Safety Check: Use 0.01 epsilon for float comparison errors
+    // If adding this note pushes us over 4.01 beats, start a new measure
+    if (currentBeats + val > BEATS_PER_MEASURE + 0.01) {
+      measures.push(currentMeasure);
+      currentMeasure = [];
+      currentBeats = 0;
+    }
+
+    currentMeasure.push(note);
+    currentBeats += val;
+  });
+  // Push the last partial measure
+  if (currentMeasure.length > 0) measures.push(currentMeasure);
+  return measures;
+};
+
+// Draws one stave per entry (empty entries get an empty stave), wrapping at
+// the container edge. Returns where the next stave would go.
+const drawMeasures = (
+  context: RenderContext,
+  measures: (RenderedNote[] | undefined)[],
+  start: StavePosition,
+  containerWidth: number
+): StavePosition => {
+  let { x, y } = start;
+
+  measures.forEach((measureNotes, offset) => {
+    const i = start.index + offset;
+    let voice: Voice | null = null;
+    let formatter: Formatter | null = null;
+    let minRequiredWidth = 0;
+
+    // 1. Prepare Voice & Calculate Note Width
+    if (measureNotes && measureNotes.length > 0) {
+      const vexNotes = convertToVexNotes(measureNotes);
+      voice = new Voice({ numBeats: BEATS_PER_MEASURE, beatValue: 4 });
+      voice.setStrict(false);
+      voice.addTickables(vexNotes);
+
+      formatter = new Formatter().joinVoices([voice]);
+      minRequiredWidth = formatter.preCalculateMinTotalWidth([voice]);
+    }
+
+    // 2. Check Wrap (Preview)
+    // We do a rough check to see if we need to move to the next line.
+    // This tells us if we will need to add a Clef (because x resets to START_X).
+    const estimatedWidth = Math.max(MIN_STAVE_WIDTH, minRequiredWidth + NOTE_PADDING);
+
+    if (x + estimatedWidth > containerWidth) {
+      x = START_X;
+      y += SYSTEM_HEIGHT;
+    }
+
+    // 3. Add Padding for Clef / Time Signature
+    // Now that 'x' is finalized, we know if we are at the start of a line.
+    let modifierPadding = 0;
+
+    // If start of line (or first measure), we will have a Treble Clef (~30px)
+    if (x === START_X || i === 0) modifierPadding += 30;
+
+    // If first measure, we will have a Time Signature (~30px)
+    if (i === 0) modifierPadding += 30;
+
+    // 4. Calculate Final Width
+    // Add the modifier padding to the Note Width so the Stave grows to accommodate both.
+    const finalMeasureWidth = Math.max(
+      MIN_STAVE_WIDTH,
+      minRequiredWidth + modifierPadding + NOTE_PADDING
+    );
+
+    // 5. Draw Stave
+    const stave = new Stave(x, y, finalMeasureWidth);
+
+    if (x === START_X || i === 0) {
+      stave.addClef("treble");
+      if (i === 0) stave.addTimeSignature("4/4");
+    }
+    stave.setContext(context).draw();
+
+    // 6. Format and Draw Voice
+    if (voice && formatter) {
+      // Now 'availableWidth' will actually be large enough for the notes
+      const startX = stave.getNoteStartX();
+      const endX = stave.getNoteEndX();
+      const availableWidth = endX - startX - 10;
+
+      if (availableWidth > 0) {
+        formatter.format([voice], availableWidth);
+        voice.draw(context, stave);
+      }
+    }
+
+    x += finalMeasureWidth;
+  });
+
+  return { x, y, index: start.index + measures.length };
+};
+
 export const SheetMusic: React.FC = () => {
   const scrollContainerRef = useRef<HTMLDivElement>(null);
   const rendererRef = useRef<HTMLDivElement>(null);
+  const liveRendererRef = useRef<HTMLDivElement>(null);
   const bottomAnchorRef = useRef<HTMLDivElement>(null);
+  const liveStartRef = useRef<StavePosition>({ x: START_X, y: START_Y, index: 0 });
+  const scoreHeightRef = useRef(SYSTEM_HEIGHT);
 
-  const { notes, activeNotes, bpm, loadNotesFromBackend, forceRenderTick } = useScoreStore();
+  const { notes, activeNotes, pendingNotes, bpm, loadNotesFromBackend, forceRenderTick } = useScoreStore();
+
+  const measures = useMemo(() => groupIntoMeasures(notes), [notes]);
 
   useEffect(() => {
     loadNotesFromBackend();
@@ -54,156 +174,84 @@ export const SheetMusic: React.FC = () => {
     return () => clearInterval(interval);
   }, [activeNotes.size, forceRenderTick]);
 
+  // --- SETTLED SCORE: only redrawn when a measure arrives (or the score is loaded/cleared) ---
   useEffect(() => {
     if (!rendererRef.current || !scrollContainerRef.current) return;
 
-    // --- PREPARE DATA ---
-    const allNotesToRender = [...notes];
-    const now = Date.now() / 1000;
-
-    activeNotes.forEach((data) => {
-      const currentDurationSec = now - data.startTime;
-      const liveDuration = quantizeDuration(currentDurationSec, bpm);
-
-      allNotesToRender.push({
-        id: `temp-${data.midi}`,
-        keys: [formatToVexKey(data.noteName)],
-        duration: liveDuration,
-
-        // --- ADD THESE TWO LINES TO FIX TYPE ERROR ---
-        rawDuration: currentDurationSec,
-        startTimeOffset: data.startTime,
-        // ---------------------------------------------
-
-        isRest: false,
-        color: "#ff0000"
-      });
-    });
-
-    // --- RENDER ---
     rendererRef.current.innerHTML = ''; // Clear previous render
 
-    // 1. Calculate Measures (Strict Grouping)
-    const measures: RenderedNote[][] = [];
-    let currentMeasure: RenderedNote[] = [];
-    let currentBeats = 0;
-
-    allNotesToRender.forEach((note) => {
-      const val = getNoteDuration(note.duration);
-
-      // Safety Check: Use 0.01 epsilon for float comparison errors
-      // If adding this note pushes us over 4.01 beats, start a new measure
-      if (currentBeats + val > BEATS_PER_MEASURE + 0.01) {
-        measures.push(currentMeasure);
-        currentMeasure = [];
-        currentBeats = 0;
-      }
-
-      currentMeasure.push(note);
-      currentBeats += val;
-    });
-    // Push the last partial measure
-    if (currentMeasure.length > 0) measures.push(currentMeasure);
-
-    // 2. Setup Renderer
-    const filledCount = measures.length;
-    const totalStaves = Math.ceil(Math.max(filledCount, 1) / MEASURE_BATCH_SIZE) * MEASURE_BATCH_SIZE;
-
     const containerWidth = Math.max(800, scrollContainerRef.current.clientWidth - 40);
     const renderer = new Renderer(rendererRef.current, Renderer.Backends.SVG);
     const context = renderer.getContext();
 
-    let x = START_X;
-    let y = START_Y;
-
-    // 3. Render Loop
-    // 3. Render Loop
-    for (let i = 0; i < totalStaves; i++) {
-      const measureNotes = measures[i];
-      let voice: Voice | null = null;
-      let formatter: Formatter | null = null;
-      let minRequiredWidth = 0;
-
-      // 1. Prepare Voice & Calculate Note Width
-      if (measureNotes && measureNotes.length > 0) {
-        const vexNotes = convertToVexNotes(measureNotes);
-        voice = new Voice({ numBeats: BEATS_PER_MEASURE, beatValue: 4 });
-        voice.setStrict(false);
-        voice.addTickables(vexNotes);
-
-        formatter = new Formatter().joinVoices([voice]);
-        minRequiredWidth = formatter.preCalculateMinTotalWidth([voice]);
-      }
+    const liveStart = drawMeasures(context, measures, { x: START_X, y: START_Y, index: 0 }, containerWidth);
+    liveStartRef.current = liveStart;
 
-      // 2. Check Wrap (Preview)
-      // We do a rough check to see if we need to move to the next line.
-      // This tells us if we will need to add a Clef (because x resets to START_X).
-      const estimatedWidth = Math.max(MIN_STAVE_WIDTH, minRequiredWidth + NOTE_PADDING);
+    // Empty staves to fill the row, always leaving at least one for the live notes
+    const totalStaves = Math.ceil((measures.length + 1) / MEASURE_BATCH_SIZE) * MEASURE_BATCH_SIZE;
+    const end = drawMeasures(context, new Array(totalStaves - measures.length).fill(undefined), liveStart, containerWidth);
 
-      if (x + estimatedWidth > containerWidth) {
-        x = START_X;
-        y += SYSTEM_HEIGHT;
-      }
-
-      // 3. Add Padding for Clef / Time Signature
-      // Now that 'x' is finalized, we know if we are at the start of a line.
-      let modifierPadding = 0;
-
-      // If start of line (or first measure), we will have a Treble Clef (~30px)
-      if (x === START_X || i === 0) modifierPadding += 30;
+    const finalHeight = end.y + SYSTEM_HEIGHT;
+    scoreHeightRef.current = finalHeight;
+    rendererRef.current.style.height = `${finalHeight}px`;
+    renderer.resize(containerWidth, finalHeight);
 
-      // If first measure, we will have a Time Signature (~30px)
-      if (i === 0) modifierPadding += 30;
+    if (notes.length > 0) {
+      bottomAnchorRef.current?.scrollIntoView({ behavior: "smooth", block: "nearest" });
+    }
+  }, [measures, notes.length]);
 
-      // 4. Calculate Final Width
-      // Add the modifier padding to the Note Width so the Stave grows to accommodate both.
-      const finalMeasureWidth = Math.max(
-        MIN_STAVE_WIDTH,
-        minRequiredWidth + modifierPadding + NOTE_PADDING
-      );
+  // --- LIVE NOTES: finished-but-unsettled (grey) and sounding (red), drawn on an overlay after the score ---
+  useEffect(() => {
+    if (!liveRendererRef.current || !scrollContainerRef.current) return;
 
-      // 5. Draw Stave
-      const stave = new Stave(x, y, finalMeasureWidth);
+    liveRendererRef.current.innerHTML = '';
+    if (pendingNotes.length === 0 && activeNotes.size === 0) return;
 
-      if (x === START_X || i === 0) {
-        stave.addClef("treble");
-        if (i === 0) stave.addTimeSignature("4/4");
-      }
-      stave.setContext(context).draw();
-
-      // 6. Format and Draw Voice
-      if (voice && formatter) {
-        // Now 'availableWidth' will actually be large enough for the notes
-        const startX = stave.getNoteStartX();
-        const endX = stave.getNoteEndX();
-        const availableWidth = endX - startX - 10;
-
-        if (availableWidth > 0) {
-          formatter.format([voice], availableWidth);
-          voice.draw(context, stave);
-        }
-      }
+    const liveNotes: RenderedNote[] = pendingNotes.map((data, i) => ({
+      id: `pending-${i}`,
+      keys: [formatToVexKey(data.noteName)],
+      duration: quantizeDuration(data.duration, bpm),
+      rawDuration: data.duration,
+      startTimeOffset: data.startTime,
+      isRest: false,
+      color: "#999999"
+    }));
 
-      x += finalMeasureWidth;
-    }
+    const now = Date.now() / 1000;
+    activeNotes.forEach((data) => {
+      const currentDurationSec = now - data.startTime;
 
-    const finalHeight = y + SYSTEM_HEIGHT;
-    rendererRef.current.style.height = `${finalHeight}px`;
-    renderer.resize(containerWidth, finalHeight);
+      liveNotes.push({
+        id: `temp-${data.midi}`,
+        keys: [formatToVexKey(data.noteName)],
+        duration: quantizeDuration(currentDurationSec, bpm),
+        rawDuration: currentDurationSec,
+        startTimeOffset: data.startTime,
+        isRest: false,
+        color: "#ff0000"
+      });
+    });
 
-    if (activeNotes.size > 0 || notes.length > 0) {
-      bottomAnchorRef.current?.scrollIntoView({ behavior: "smooth", block: "nearest" });
-    }
+    const containerWidth = Math.max(800, scrollContainerRef.current.clientWidth - 40);
+    const renderer = new Renderer(liveRendererRef.current, Renderer.Backends.SVG);
+    const context = renderer.getContext();
+    const end = drawMeasures(context, groupIntoMeasures(liveNotes), liveStartRef.current, containerWidth);
+    renderer.resize(containerWidth, Math.max(scoreHeightRef.current, end.y + SYSTEM_HEIGHT));
 
-  }, [notes, activeNotes, bpm]);
+    bottomAnchorRef.current?.scrollIntoView({ behavior: "smooth", block: "nearest" });
+  }, [measures, pendingNotes, activeNotes, bpm]);
 
   return (
     <div
       ref={scrollContainerRef}
       className="sheet-music-container"
     >
-      <div ref={rendererRef} />
+      <div style={{ position: 'relative' }}>
+        <div ref={rendererRef} />
+        <div ref={liveRendererRef} style={{ position: 'absolute', top: 0, left: 0, pointerEvents: 'none' }} />
+      </div>
       <div ref={bottomAnchorRef} style={{ height: 1 }} />
     </div>
   );
-};
\ No newline at end of file
+};
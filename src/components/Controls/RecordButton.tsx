@@ -1,48 +1,89 @@
 import React, { useEffect, useState, useRef, useCallback } from 'react';
 import { useScoreStore } from '../../store/scoreStore';
+import type { RenderedNote } from '../../types';
 
 interface NoteEvent {
-  type: 'note_on' | 'note_off' | 're_trigger' | 'volume' | 'silence_reset';
+  type: 'note_on' | 'note_off' | 're_trigger' | 'volume' | 'silence_reset' | 'queue' | 'admitted' | 'session'
+    | 'measure' | 'take_end';
   note?: string;
   midi?: number;
   event?: string;
   value?: number;
   duration?: number;   
   start_time?: number;
+  position?: number;   // 'queue': our place in line while the server is full
+  token?: string;      // 'session': server-side log of this take, used to resume it
+  resumed?: boolean;
+  next_measure?: number; // 'session': first measure this connection sends (a resumed take skips those already sent)
+  measure?: number;    // 'measure': a settled, full measure quantized by the server
+  notes?: RenderedNote[];
+  until?: number;      // 'measure': notes starting before this are now in measures
 }
 
+// Close codes sent by the audio server's admission control
+const CLOSE_MESSAGES: Record<number, string> = {
+  1013: 'The transcription server is busy right now. Please try again in a minute.',
+  4401: 'Your login has expired. Please log in again to record.',
+  4429: 'You already have a recording running in another tab or window.',
+  1011: 'The server could not save your recording. Please try again.',
+};
+
+const AUDIO_SERVER_URL = 'ws://localhost:8000/';
+const MAX_RECONNECTS = 5; // Attempts to resume a take after the connection drops
+const TAKE_END_TIMEOUT = 3000; // How long stop waits for the server's last measures
+
 export const RecordButton: React.FC = () => {
   const [isRecording, setIsRecording] = useState(false);
+  const [queuePosition, setQueuePosition] = useState<number | null>(null);
   
   // Import saveRecording from the store
-  const { handleNoteOn, handleNoteOff, saveRecording } = useScoreStore(); 
+  const {
+    bpm, handleNoteOn, handleNoteOff, applyMeasure, endTake, saveRecording, startTake, setRecordingToken,
+  } = useScoreStore();
 
   const socketRef = useRef<WebSocket | null>(null);
   const audioContextRef = useRef<AudioContext | null>(null);
   const workletNodeRef = useRef<AudioWorkletNode | null>(null);
+  const stoppingRef = useRef(false);                     // Set once the take is over, so we don't reconnect
+  const recordingTokenRef = useRef<string | null>(null); // From the 'session' event
+  const reconnectsRef = useRef(0);
+  const finishTakeRef = useRef<(() => void) | null>(null); // Runs once the server confirms the take ended
 
   // --- CHANGED: Wrapped in useCallback to fix dependency warning ---
   const stopAudio = useCallback(() => {
+    stoppingRef.current = true;
+
     // 1. Clean up Audio Context
     if (audioContextRef.current) {
       audioContextRef.current.close();
       audioContextRef.current = null;
     }
     
-    // 2. Clean up WebSocket
-    if (socketRef.current) {
-      socketRef.current.close();
-      socketRef.current = null;
-    }
+    // 2. Finish the take: the server sends the last (partial) measure, then 'take_end'
+    const socket = socketRef.current;
+    socketRef.current = null;
+    let finished = false;
+    const finishTake = () => {
+      if (finished) return;
+      finished = true;
+      finishTakeRef.current = null;
+      socket?.close();
+      endTake();
+      // 3. Trigger Batch Save
+      saveRecording();
+    };
 
     setIsRecording(false);
-
-    // 3. Trigger Batch Save
-    // We wait a tiny bit to ensure the last note_off events are processed
-    setTimeout(() => {
-        saveRecording();
-    }, 200);
-  }, [saveRecording]); 
+    setQueuePosition(null);
+
+    if (socket?.readyState === WebSocket.OPEN) {
+      finishTakeRef.current = finishTake;
+      socket.send(JSON.stringify({ type: 'stop' }));
+      setTimeout(finishTake, TAKE_END_TIMEOUT);
+    } else {
+      finishTake();
+    }
+  }, [saveRecording, endTake]); 
 
   const handleServerEvent = (data: NoteEvent) => {
     if (data.type === 'note_on' && data.midi !== undefined && data.note) {
@@ -51,17 +92,48 @@ export const RecordButton: React.FC = () => {
     }
     else if (data.type === 'note_off' && data.midi !== undefined) {
         console.log(`🛑 Note OFF: ${data.note} | Start: ${data.start_time?.toFixed(3)}s | Duration: ${data.duration?.toFixed(3)}s`);
-        handleNoteOff(data.midi);
+        if (data.note && data.start_time !== undefined && data.duration !== undefined) {
+          handleNoteOff(data.midi, data.note, data.start_time, data.duration);
+        }
+    }
+    else if (data.type === 'measure' && data.measure !== undefined && data.notes && data.until !== undefined) {
+        applyMeasure(data.measure, data.notes, data.until);
+    }
+    else if (data.type === 'take_end') {
+        finishTakeRef.current?.();
     }
     else if (data.type === 'silence_reset') {
         console.log("Silence Reset");
     }
+    else if (data.type === 'queue' && data.position !== undefined) {
+        setQueuePosition(data.position);
+    }
+    else if (data.type === 'admitted') {
+        setQueuePosition(null);
+        reconnectsRef.current = 0;
+    }
+    else if (data.type === 'session' && data.token) {
+        console.log(data.resumed ? "Resumed recording after reconnect" : "Recording is being logged on the server");
+        recordingTokenRef.current = data.token;
+        setRecordingToken(data.token, data.next_measure);
+    }
   };
 
-  const startStreaming = async () => {
-    socketRef.current = new WebSocket('ws://localhost:8000');
-
-    socketRef.current.onopen = async () => {
+  const openSocket = (resumeToken: string | null) => {
+    // bpm turns on server-side quantization, so notes arrive as settled measures
+    const params = new URLSearchParams({ bpm: String(bpm) });
+    // The auth token lets the server apply per-user limits and log the take for us
+    const token = localStorage.getItem('auth-token');
+    if (token) params.set('auth', token);
+    if (resumeToken) params.set('session', resumeToken);
+    const socket = new WebSocket(`${AUDIO_SERVER_URL}?${params.toString()}`);
+    socketRef.current = socket;
+
+    socket.onopen = async () => {
+      if (audioContextRef.current) {
+        console.log("WebSocket reconnected. Resuming take...");
+        return;
+      }
       console.log("WebSocket connected. Starting Audio...");
       setIsRecording(true);
       
@@ -95,6 +167,7 @@ export const RecordButton: React.FC = () => {
       } catch (err) {
         console.error("Audio setup failed:", err);
         // Safely close if setup fails
+        stoppingRef.current = true;
         if (socketRef.current) {
             socketRef.current.close();
             socketRef.current = null;
@@ -103,7 +176,7 @@ export const RecordButton: React.FC = () => {
       }
     };
 
-    socketRef.current.onmessage = (event) => {
+    socket.onmessage = (event) => {
       try {
         const data: NoteEvent = JSON.parse(event.data);
         handleServerEvent(data);
@@ -112,9 +185,31 @@ export const RecordButton: React.FC = () => {
       }
     };
 
-    socketRef.current.onclose = () => {
+    socket.onclose = (event) => {
+      // Sockets we already replaced or are closing ourselves; a stop in progress ends here at the latest
+      if (socketRef.current !== socket) {
+        finishTakeRef.current?.();
+        return;
+      }
+
+      // Dropped mid-take: reconnect and keep appending to the server's log of it
+      const canResume = !stoppingRef.current && recordingTokenRef.current && !CLOSE_MESSAGES[event.code];
+      if (canResume && reconnectsRef.current < MAX_RECONNECTS) {
+        const delay = 500 * 2 ** reconnectsRef.current;
+        reconnectsRef.current += 1;
+        console.warn(`Connection lost (${event.code}), resuming take in ${delay}ms`);
+        setTimeout(() => {
+          if (!stoppingRef.current) openSocket(recordingTokenRef.current);
+        }, delay);
+        return;
+      }
+
       // If the socket closes (server dies or we stopped it), ensure UI updates
       setIsRecording(false);
+      setQueuePosition(null);
+      if (CLOSE_MESSAGES[event.code]) {
+        alert(CLOSE_MESSAGES[event.code]);
+      }
       // We check if it's already null to avoid recursion loops with stopAudio
       if (audioContextRef.current) { 
         stopAudio(); 
@@ -122,6 +217,14 @@ export const RecordButton: React.FC = () => {
     };
   };
 
+  const startStreaming = () => {
+    stoppingRef.current = false;
+    recordingTokenRef.current = null;
+    reconnectsRef.current = 0;
+    startTake();
+    openSocket(null);
+  };
+
   // Cleanup on unmount
   useEffect(() => {
     return () => {
@@ -141,7 +244,9 @@ export const RecordButton: React.FC = () => {
           : 'text-blue-600 border-blue-200 bg-white hover:bg-blue-50'
       }`}
     >
-      {isRecording ? 'Stop Recording' : 'Record Audio'}
+      {queuePosition !== null
+        ? `Waiting for server (#${queuePosition})`
+        : isRecording ? 'Stop Recording' : 'Record Audio'}
     </button>
   );
 };
\ No newline at end of file
@@ -1,8 +1,7 @@
 import { create } from 'zustand';
 import { persist } from 'zustand/middleware';
-import type { RenderedNote } from '../types';
-import { fetchNotes, clearAllNotes, saveSession } from '../api/api';
-import { quantizeDuration } from '../utils/musicMath';
+import type { RenderedNote, RecordingRef, SessionSaveResponse } from '../types';
+import { fetchNotes, clearAllNotes, saveSession, patchSession } from '../api/api';
 
 interface ActiveNoteData {
   startTime: number;
@@ -10,19 +9,42 @@ interface ActiveNoteData {
   midi: number;
 }
 
+// A finished note the server has not placed in a measure yet (times are take-relative, from note_off)
+export interface PendingNoteData {
+  midi: number;
+  noteName: string;
+  startTime: number;
+  duration: number;
+}
+
 interface ScoreState {
   notes: RenderedNote[];
   activeNotes: Map<number, ActiveNoteData>;
+  pendingNotes: PendingNoteData[];
+  lastMeasure: number; // Last measure of the current take the server sent
   bpm: number;
   isMetronomeOn: boolean;
 
+  // Backend session the notes are saved to, so later saves only send new notes
+  sessionId: string | null;
+  sessionVersion: number;
+  savedNoteCount: number;
+
+  // Live take the audio server is logging (signed-in users only)
+  recordingToken: string | null;
+  takeStart: number; // Index in notes where the current take begins
+
   setBpm: (newBpm: number) => void;
   clearScore: () => void;
   loadNotesFromBackend: () => Promise<void>;
   toggleMetronome: () => void;
   handleNoteOn: (midi: number, noteName: string) => void;
-  handleNoteOff: (midi: number) => void;
+  handleNoteOff: (midi: number, noteName: string, startTime: number, duration: number) => void;
+  applyMeasure: (measure: number, measureNotes: RenderedNote[], until: number) => void;
+  endTake: () => void;
   forceRenderTick: () => void;
+  startTake: () => void;
+  setRecordingToken: (token: string, nextMeasure?: number) => void;
 
   saveRecording: () => Promise<void>;
 }
@@ -39,11 +61,27 @@ export const useScoreStore = create<ScoreState>()(
     (set, get) => ({
       notes: [],
       activeNotes: new Map(),
+      pendingNotes: [],
+      lastMeasure: -1,
       bpm: 100,
       isMetronomeOn: false,
+      sessionId: null,
+      sessionVersion: 0,
+      savedNoteCount: 0,
+      recordingToken: null,
+      takeStart: 0,
 
       setBpm: (newBpm) => set({ bpm: newBpm }),
 
+      startTake: () => set({
+        recordingToken: null, takeStart: get().notes.length, lastMeasure: -1, pendingNotes: [],
+      }),
+
+      // Follow the server's measure numbering, so a resumed take's measures are not dropped as already seen
+      setRecordingToken: (token, nextMeasure) => set(
+        nextMeasure === undefined ? { recordingToken: token } : { recordingToken: token, lastMeasure: nextMeasure - 1 }
+      ),
+
       handleNoteOn: (midi, noteName) => {
         const { activeNotes } = get();
         const newActive = new Map(activeNotes);
@@ -51,50 +89,86 @@ export const useScoreStore = create<ScoreState>()(
         set({ activeNotes: newActive });
       },
 
-      handleNoteOff: (midi) => {
-        const { activeNotes, notes, bpm } = get();
-        const noteData = activeNotes.get(midi);
-
-        if (noteData) {
-          const durationSec = (Date.now() / 1000) - noteData.startTime;
-          const finalDuration = quantizeDuration(durationSec, bpm);
-
-          const newNote: RenderedNote = {
-            id: crypto.randomUUID(),
-            keys: [formatToVexKey(noteData.noteName)],
-            duration: finalDuration,
-            rawDuration: durationSec,
-            startTimeOffset: noteData.startTime,
-            isRest: false,
-            color: 'black'
-          };
-
-          const newActive = new Map(activeNotes);
-          newActive.delete(midi);
+      // The note waits as "pending" until the server sends the measure it lands in
+      handleNoteOff: (midi, noteName, startTime, duration) => {
+        const { activeNotes, pendingNotes } = get();
+        const newActive = new Map(activeNotes);
+        newActive.delete(midi);
+        set({
+          activeNotes: newActive,
+          pendingNotes: [...pendingNotes, { midi, noteName, startTime, duration }],
+        });
+      },
 
-          set({
-            activeNotes: newActive,
-            notes: [...notes, newNote]
-          });
-        }
+      // Settled measures arrive in order and never change, so each one is just appended
+      applyMeasure: (measure, measureNotes, until) => {
+        const { notes, pendingNotes, lastMeasure } = get();
+        if (measure <= lastMeasure) return;
+        set({
+          notes: [...notes, ...measureNotes],
+          pendingNotes: pendingNotes.filter((note) => note.startTime >= until),
+          lastMeasure: measure,
+        });
       },
 
+      endTake: () => set({ activeNotes: new Map(), pendingNotes: [] }),
+
       // --- FIXED: SAVE ACTION ---
       saveRecording: async () => {
-        const { notes, bpm } = get();
+        const { notes, bpm, sessionId, sessionVersion, savedNoteCount, recordingToken, takeStart } = get();
         
         // REMOVED: if (notes.length === 0) return; 
         // We MUST allow saving empty notes to persist the "cleared" state.
 
+        // The server keeps its own log of the take and stores that instead of our copy
+        const recording: RecordingRef | undefined =
+          recordingToken && takeStart <= notes.length ? { token: recordingToken, start: takeStart } : undefined;
+
+        // Swap in the take as the server stored it, so later appends line up
+        const applySaved = (result: SessionSaveResponse) => {
+          const saved = result.recording
+            ? [...notes.slice(0, result.recording.start), ...result.recording.notes]
+            : notes;
+          set((state) => ({
+            // Keep anything that arrived while the save was in flight
+            notes: [...saved, ...state.notes.slice(notes.length)],
+            sessionId: result.session_id,
+            sessionVersion: result.version,
+            savedNoteCount: result.note_count,
+            recordingToken: null,
+          }));
+        };
+
+        // Notes only grow between saves, so just append the new ones
+        if (sessionId && notes.length >= savedNoteCount) {
+          try {
+            const newNotes = notes.slice(savedNoteCount);
+            const result = await patchSession(sessionId, {
+              version: sessionVersion,
+              bpm,
+              ops: newNotes.length > 0 ? [{ op: 'append', notes: newNotes }] : [],
+              recording,
+            });
+            applySaved(result);
+            console.log(`Appended ${newNotes.length} notes to session.`);
+            return;
+          } catch (error) {
+            // Conflict or missing session: fall back to a full save below
+            console.warn("Delta save failed, saving full session instead", error);
+          }
+        }
+
         try {
           console.log("Saving batch to backend...");
-          await saveSession({
+          const result = await saveSession({
             // Optional: Give it a different title if empty, or keep generic
             title: notes.length === 0 ? "Empty Session" : `Recording ${new Date().toLocaleString()}`,
             bpm,
             notes, 
-            createdAt: new Date().toISOString()
+            createdAt: new Date().toISOString(),
+            recording,
           });
+          applySaved(result);
           console.log("Save successful!");
         } catch (error) {
           console.error("Failed to upload, but data is safe in LocalStorage", error);
@@ -109,7 +183,10 @@ export const useScoreStore = create<ScoreState>()(
       },
 
       clearScore: () => {
-        set({ notes: [], activeNotes: new Map() });
+        set({
+          notes: [], activeNotes: new Map(), pendingNotes: [], sessionId: null, sessionVersion: 0, savedNoteCount: 0,
+          recordingToken: null, takeStart: 0, lastMeasure: -1,
+        });
         clearAllNotes().catch(e => console.error(e));
       },
 
@@ -117,7 +194,11 @@ export const useScoreStore = create<ScoreState>()(
         const fetchedNotes = await fetchNotes();
         // Ensure we load even if it's an empty array, provided the fetch was successful
         if (fetchedNotes) {
-          set({ notes: fetchedNotes });
+          // We don't know which session these came from, so the next save is a full one
+          set({
+            notes: fetchedNotes, sessionId: null, sessionVersion: 0, savedNoteCount: 0,
+            recordingToken: null, takeStart: 0,
+          });
         }
       },
 
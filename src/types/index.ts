@@ -1,5 +1,5 @@
 // Standard VexFlow notation codes
-export type NoteDuration = 'w' | 'hd' | 'h' | 'qd' | 'q' | 'qr' | '8' | '8r' | '16';
+export type NoteDuration = 'w' | 'hd' | 'h' | 'qd' | 'q' | 'qr' | '8d' | '8' | '8r' | '16';
 
 export interface RenderedNote {
   id: string;
@@ -14,9 +14,37 @@ export interface RenderedNote {
   color?: string;   
 }
 
+// A live take the audio server logged; the backend stores its own copy of it
+export interface RecordingRef {
+  token: string; // From the audio server's 'session' event
+  start: number; // notes[start:] are our copy of that take
+}
+
 export interface SessionPayload {
   title: string;
   bpm: number;
   notes: RenderedNote[];
   createdAt: string;
+  recording?: RecordingRef;
+}
+
+// Delta update for an existing session (PATCH /sessions/:id)
+export type NoteOp =
+  | { op: 'append'; notes: RenderedNote[] }
+  | { op: 'replace_range'; start: number; end: number; notes: RenderedNote[] };
+
+export interface SessionPatchPayload {
+  version: number; // Version we last saw; the server answers 409 if it changed
+  ops: NoteOp[];
+  title?: string;
+  bpm?: number;
+  recording?: RecordingRef;
+}
+
+export interface SessionSaveResponse {
+  session_id: string;
+  version: number;
+  note_count: number;
+  // The stored take, when a recording was handed over; replaces notes[start:]
+  recording: { start: number; notes: RenderedNote[] } | null;
 }
\ No newline at end of file
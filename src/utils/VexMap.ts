@@ -9,7 +9,8 @@ export const convertToVexNotes = (notes: RenderedNote[]) => {
     const staveNote = new StaveNote({
       clef: "treble", 
       keys: note.keys,
-      duration: baseDuration,
+      // VexFlow draws a rest when the duration ends in 'r'
+      duration: note.isRest ? `${baseDuration}r` : baseDuration,
       autoStem: true,
     });
 
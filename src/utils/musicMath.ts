@@ -31,6 +31,7 @@ export const getDurationValue = (duration: string): number => {
     case 'qd': return 1.5;
     case 'q':  return 1;
     case 'qr': return 2/3;
+    case '8d': return 0.75;
     case '8':  return 0.5;
     case '8r': return 1/3;
     case '16': return 0.25;